@@ -0,0 +1,75 @@
+"""Scaling of bulk compression with the number of workers: python -m benchmarks.bulk_compression --help"""
+import argparse
+import os
+import time
+
+import numpy
+from django.conf import settings
+
+from yaft_preprocessor.utils.compression import COMPRESSION_TYPES, LAYOUTS, PLAIN, compress_lists, decompress_values
+from yaft_preprocessor.utils.workers import shutdown_pools
+
+
+def posting_lists(lists, mean_length, documents, seed=0):
+    # lists with geometrically distributed lengths of sorted, distinct document ids
+    random = numpy.random.RandomState(seed)
+    lengths = random.geometric(1 / mean_length, size=lists).clip(max=documents)
+    return {
+        str(i): numpy.sort(random.choice(documents, size=length, replace=False)).tolist()
+        for i, length in enumerate(lengths)
+    }
+
+
+def measure(function, *arguments):
+    started = time.perf_counter()
+    result = function(*arguments)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lists', type=int, default=20000)
+    parser.add_argument('--mean-length', type=int, default=200)
+    parser.add_argument('--documents', type=int, default=10 ** 6)
+    parser.add_argument('--codecs', nargs='+', choices=COMPRESSION_TYPES, default=['gamma', 'pfordelta'])
+    parser.add_argument('--layout', choices=LAYOUTS, default=PLAIN)
+    parser.add_argument(
+        '--workers', type=int, nargs='+',
+        default=sorted({2 ** i for i in range(os.cpu_count().bit_length())} | {os.cpu_count()})
+    )
+    arguments = parser.parse_args()
+    settings.configure(
+        COMPRESSION_AUTO={'criterion': 'size', 'tolerance': 0.1}, COMPRESSION_BLOCK_SIZE=128,
+        WORKER_POOL={'workers': 1}, BULK_COMPRESSION={'min_bytes': 0}, NLP_RESOURCES={}, STEM_CACHE={}
+    )
+
+    integer_lists = posting_lists(arguments.lists, arguments.mean_length, arguments.documents)
+    integers = sum(map(len, integer_lists.values()))
+    print('{} lists of {} integers on {} cores'.format(len(integer_lists), integers, os.cpu_count()))
+    # throughput is in MB/s of the integers as 4 byte words; workers 0 is the serial mode
+    print('{:>10} {:>8} {:>12} {:>12} {:>8}'.format('codec', 'workers', 'encode MB/s', 'decode MB/s', 'speedup'))
+    for codec in arguments.codecs:
+        serial_time = None
+        for workers in [0] + arguments.workers:
+            settings.WORKER_POOL = {'workers': workers}
+            settings.BULK_COMPRESSION = {'min_bytes': 0 if workers else float('inf')}
+            shutdown_pools()
+            if workers:
+                # the first call starts the workers
+                compress_lists({'0': [0]}, codec)
+            compressed_values, encode_time = measure(compress_lists, integer_lists, codec, arguments.layout)
+            decompressed, decode_time = measure(decompress_values, compressed_values, codec, arguments.layout)
+            assert decompressed == integer_lists, codec
+            if serial_time is None:
+                serial_time = encode_time + decode_time
+                serial_values = compressed_values
+            assert compressed_values == serial_values, codec
+            print('{:>10} {:>8} {:>12.2f} {:>12.2f} {:>8.2f}'.format(
+                codec, workers, integers * 4 / encode_time / 10 ** 6, integers * 4 / decode_time / 10 ** 6,
+                serial_time / (encode_time + decode_time)
+            ))
+    shutdown_pools()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Throughput of the posting list codecs: python -m benchmarks.compression --help"""
+import argparse
+import math
+import time
+
+import bitstring
+import numpy
+import vbcode
+from django.conf import settings
+
+from yaft_preprocessor.utils.compression import COMPRESSION_TYPES, COMPRESSORS, DECOMPRESSORS, MAGIC, SIZE, SPEED
+
+
+# The bitstring based gamma codec the current one replaced, kept as the reference for its output and speed.
+# Its decoder is quadratic in the length of the list, so it only runs on --reference-integers integers.
+def reference_compress_using_gamma(integers):
+    bits = bitstring.BitArray()
+    for integer in integers:
+        bit_length = int(math.log(integer, 2))
+        for _ in range(bit_length):
+            bits.append('0b1')
+        bits.append('0b0')
+        integer_bits = []
+        while integer > 0:
+            integer_bits.append(integer % 2)
+            integer //= 2
+        for i in list(reversed(integer_bits))[1:]:
+            bits.append('0b1' if i == 1 else '0b0')
+    binary = bits.bin
+    binary = '0b' + ((8 - (len(binary) % 8)) * '0') + MAGIC + binary
+    return bitstring.BitArray(binary).hex
+
+
+def reference_decompress_using_gamma(compressed_value):
+    bits = bitstring.BitArray(hex=compressed_value).bin
+    magic_index = bits.index(MAGIC)
+    bits = bits[magic_index + 8:]
+    integers = []
+    while bits:
+        integer_length = bits.index('0')
+        bits = bits[integer_length + 1:]
+        integers.append(int('1' + bits[:integer_length], 2))
+        bits = bits[integer_length:]
+    return integers
+
+
+REFERENCE = 'gamma_reference'
+VARIABLE_BYTE_REFERENCE = 'varbyte_reference'
+# the vbcode package, whose format the varbyte codec writes
+REFERENCE_CODECS = {
+    REFERENCE: (reference_compress_using_gamma, reference_decompress_using_gamma),
+    VARIABLE_BYTE_REFERENCE: (vbcode.encode, vbcode.decode),
+}
+
+
+def posting_gaps(integers, density, seed=0):
+    # the gaps between the ids of documents that each contain the term with probability `density`
+    return numpy.random.RandomState(seed).geometric(density, size=integers)
+
+
+def bursty_gaps(integers, density, seed=0):
+    # terms that come in runs: mostly short gaps within a run of related documents, and long ones between runs
+    random = numpy.random.RandomState(seed)
+    gaps = random.geometric(0.5, size=integers)
+    between_runs = random.random_sample(integers) < 0.1
+    gaps[between_runs] = random.geometric(density, size=between_runs.sum())
+    return gaps
+
+
+DISTRIBUTIONS = {
+    'uniform': posting_gaps,
+    'bursty': bursty_gaps,
+}
+
+
+def measure(function, argument):
+    started = time.perf_counter()
+    result = function(argument)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--integers', type=int, default=10 ** 6)
+    parser.add_argument('--reference-integers', type=int, default=20000)
+    parser.add_argument('--densities', type=float, nargs='+', default=[0.5, 0.05, 0.001])
+    parser.add_argument('--distributions', nargs='+', choices=DISTRIBUTIONS, default=list(DISTRIBUTIONS))
+    parser.add_argument('--codecs', nargs='+', default=list(COMPRESSION_TYPES) + list(REFERENCE_CODECS))
+    parser.add_argument('--auto-criterion', choices=(SIZE, SPEED), default=SIZE)
+    parser.add_argument('--auto-tolerance', type=float, default=0.1)
+    arguments = parser.parse_args()
+    settings.configure(COMPRESSION_AUTO={'criterion': arguments.auto_criterion, 'tolerance': arguments.auto_tolerance})
+
+    # throughput is in MB/s of the integers as 4 byte words
+    print('{:>17} {:>12} {:>8} {:>9} {:>10} {:>12} {:>12}'.format(
+        'codec', 'distribution', 'density', 'integers', 'bits/int', 'encode MB/s', 'decode MB/s'
+    ))
+    for distribution in arguments.distributions:
+        for density in arguments.densities:
+            for codec in arguments.codecs:
+                # the gamma reference writes hex, the others bytes
+                if codec in REFERENCE_CODECS:
+                    compressor, decompressor = REFERENCE_CODECS[codec]
+                    integers = arguments.reference_integers
+                    bits_per_unit = 4 if codec == REFERENCE else 8
+                else:
+                    compressor, decompressor = COMPRESSORS[codec], DECOMPRESSORS[codec]
+                    integers = arguments.integers
+                    bits_per_unit = 8
+                gaps = DISTRIBUTIONS[distribution](integers, density)
+                if codec in REFERENCE_CODECS:
+                    gaps = gaps.tolist()
+                compressed, encode_time = measure(compressor, gaps)
+                decompressed, decode_time = measure(decompressor, compressed)
+                assert numpy.array_equal(decompressed, gaps), codec
+                print('{:>17} {:>12} {:>8} {:>9} {:>10.2f} {:>12.2f} {:>12.2f}'.format(
+                    codec, distribution, density, integers, len(compressed) * bits_per_unit / integers,
+                    integers * 4 / encode_time / 10 ** 6, integers * 4 / decode_time / 10 ** 6
+                ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Recall and latency of the KNN index against exact search: python -m benchmarks.knn --help"""
+import argparse
+import itertools
+import time
+
+import numpy
+from scipy.sparse import csr_matrix
+
+from yaft_preprocessor.utils.nearest_neighbours import METRICS, ExactIndex, LSHIndex
+
+
+def synthetic_corpus(documents, terms, topics, terms_per_document, seed=0):
+    # documents draw most of their terms from one topic's vocabulary and the rest from the whole vocabulary
+    random = numpy.random.RandomState(seed)
+    topic_vocabularies = [random.choice(terms, size=terms // topics * 2, replace=False) for _ in range(topics)]
+    rows = []
+    columns = []
+    for document in range(documents):
+        vocabulary = topic_vocabularies[random.randint(topics)]
+        topical = vocabulary[random.zipf(1.5, size=terms_per_document) % len(vocabulary)]
+        background = random.randint(terms, size=terms_per_document // 5)
+        columns.extend(topical.tolist() + background.tolist())
+        rows.extend([document] * (len(topical) + len(background)))
+    matrix = csr_matrix((numpy.ones(len(rows)), (rows, columns)), shape=(documents, terms))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--terms', type=int, default=20000)
+    parser.add_argument('--topics', type=int, default=50)
+    parser.add_argument('--terms-per-document', type=int, default=60)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--metric', choices=METRICS, default=METRICS[0])
+    parser.add_argument('--tables', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--bits', type=int, nargs='+', default=[8, 12, 16])
+    parser.add_argument('--probes', type=int, nargs='+', default=[0, 4, 8])
+    arguments = parser.parse_args()
+
+    corpus = synthetic_corpus(
+        arguments.documents + arguments.queries, arguments.terms, arguments.topics, arguments.terms_per_document
+    )
+    x, queries = corpus[:arguments.documents], corpus[arguments.documents:]
+
+    exact = ExactIndex(metric=arguments.metric)
+    exact.build(x)
+    started = time.perf_counter()
+    exact_distances, _ = exact.search(queries, arguments.k)
+    exact_latency = (time.perf_counter() - started) / arguments.queries
+    kth_distances = [distances[-1] for distances in exact_distances]
+    print('exact: {:.3f} ms/query'.format(exact_latency * 1000))
+
+    print('{:>6} {:>4} {:>6} {:>8} {:>10} {:>8}'.format('tables', 'bits', 'probes', 'recall', 'ms/query', 'build s'))
+    for tables, bits, probes in itertools.product(arguments.tables, arguments.bits, arguments.probes):
+        index = LSHIndex(metric=arguments.metric, tables=tables, bits=bits, probes=probes)
+        started = time.perf_counter()
+        index.build(x)
+        build_time = time.perf_counter() - started
+        started = time.perf_counter()
+        distances, _ = index.search(queries, arguments.k)
+        latency = (time.perf_counter() - started) / arguments.queries
+        # a neighbour counts as found when it is no farther than the exact k-th one, so ties are not misses
+        recall = numpy.mean([
+            numpy.sum(d <= kth + 1e-9) / arguments.k for d, kth in zip(distances, kth_distances)
+        ])
+        print('{:>6} {:>4} {:>6} {:>8.3f} {:>10.3f} {:>8.2f}'.format(
+            tables, bits, probes, recall, latency * 1000, build_time
+        ))
+
+
+if __name__ == '__main__':
+    main()
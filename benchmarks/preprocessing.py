@@ -0,0 +1,76 @@
+"""Scaling of bulk preprocessing with the number of workers: python -m benchmarks.preprocessing --help"""
+import argparse
+import os
+import time
+
+import numpy
+from django.conf import settings
+
+from yaft_preprocessor.utils.languages import LANGUAGES
+from yaft_preprocessor.utils.preprocess import preprocess_documents
+from yaft_preprocessor.utils.workers import shutdown_pools
+
+VOCABULARIES = {
+    'en': 'the of and to in information retrieval index query document term weight ranking search engine '
+          'compression posting list language model stemming tokenizer crawler page link score vector'.split(),
+    'fa': 'و در به از که این را با است برای بازیابی اطلاعات نمایه پرسش سند واژه وزن رتبه جستجو موتور فشرده سازی '
+          'فهرست زبان مدل ریشه خزنده صفحه پیوند امتیاز بردار'.split(),
+}
+
+
+def synthetic_documents(documents, words_per_document, language, seed=0):
+    # Zipfian word frequencies over a small vocabulary, with sentence punctuation
+    random = numpy.random.RandomState(seed)
+    vocabulary = VOCABULARIES[language]
+    result = {}
+    for document in range(documents):
+        words = [vocabulary[i] for i in (random.zipf(1.3, size=words_per_document) - 1) % len(vocabulary)]
+        result[str(document)] = ' '.join(words[i] + ('.' if i % 12 == 11 else '') for i in range(len(words)))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=5000)
+    parser.add_argument('--words-per-document', type=int, default=300)
+    parser.add_argument('--language', choices=LANGUAGES, default='fa')
+    parser.add_argument('--chunk-size', type=int, default=64)
+    parser.add_argument(
+        '--workers', type=int, nargs='+',
+        default=sorted({2 ** i for i in range(os.cpu_count().bit_length())} | {os.cpu_count()})
+    )
+    arguments = parser.parse_args()
+    settings.configure(
+        WORKER_POOL={'workers': 1}, BULK_PREPROCESSING={'min_documents': 0, 'chunk_size': arguments.chunk_size},
+        NLP_RESOURCES={'offline': False, 'data_path': None}, STEM_CACHE={'max_words': 2 ** 17},
+        COMPRESSION_AUTO={}, COMPRESSION_BLOCK_SIZE=128
+    )
+
+    documents = synthetic_documents(arguments.documents, arguments.words_per_document, arguments.language)
+    print('{} documents of {} words on {} cores'.format(
+        len(documents), arguments.words_per_document, os.cpu_count()
+    ))
+    # workers 0 preprocesses in process
+    print('{:>8} {:>12} {:>8}'.format('workers', 'documents/s', 'speedup'))
+    serial_time = None
+    for workers in [0] + arguments.workers:
+        settings.WORKER_POOL = {'workers': workers}
+        settings.BULK_PREPROCESSING = {
+            'min_documents': 0 if workers else float('inf'), 'chunk_size': arguments.chunk_size
+        }
+        shutdown_pools()
+        # a first pass starts the workers, loads their resources and warms their stem caches
+        preprocess_documents(documents, arguments.language)
+        started = time.perf_counter()
+        result = preprocess_documents(documents, arguments.language)
+        elapsed = time.perf_counter() - started
+        if serial_time is None:
+            serial_time = elapsed
+            expected = result
+        assert result == expected
+        print('{:>8} {:>12.1f} {:>8.2f}'.format(workers, len(documents) / elapsed, serial_time / elapsed))
+    shutdown_pools()
+
+
+if __name__ == '__main__':
+    main()
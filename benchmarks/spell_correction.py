@@ -0,0 +1,89 @@
+"""Latency and accuracy of the spell correction engines: python -m benchmarks.spell_correction --help"""
+import argparse
+import pickle
+import time
+
+import numpy
+from django.conf import settings
+from django.core.cache import cache
+
+from yaft_preprocessor.utils.spell_correction import SPELLING_INDEXES, correct_spelling, get_spelling_index_key, \
+    index_words
+
+# letters in about their frequency in English text
+LETTERS = 'eeeeeeeeeeeetttttttttaaaaaaaaoooooooiiiiiiinnnnnnnsssssshhhhhhrrrrrrddddlllluuucccmmmwwffggyyppbbvkjxqz'
+
+
+def synthetic_vocabulary(words, seed=0):
+    random = numpy.random.RandomState(seed)
+    letters = numpy.array(list(LETTERS))
+    vocabulary = set()
+    while len(vocabulary) < words:
+        lengths = random.randint(3, 13, size=words)
+        vocabulary.update(''.join(random.choice(letters, size=length)) for length in lengths)
+    return sorted(vocabulary)[:words]
+
+
+def misspell(word, edits, random):
+    # deletions, insertions and substitutions of random letters
+    for _ in range(edits):
+        position = random.randint(len(word) + 1)
+        edit = random.randint(3) if len(word) > 1 else 1
+        letter = LETTERS[random.randint(len(LETTERS))]
+        if edit == 0:
+            word = word[:position] + word[position + 1:]
+        elif edit == 1:
+            word = word[:position] + letter + word[position:]
+        else:
+            word = word[:position] + letter + word[position + 1:]
+    return word
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', type=int, default=10 ** 6)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--edits', type=int, default=1)
+    parser.add_argument('--engines', nargs='+', choices=SPELLING_INDEXES, default=list(SPELLING_INDEXES))
+    parser.add_argument('--max-distance', type=int, default=2)
+    parser.add_argument('--prefix-length', type=int, default=7)
+    arguments = parser.parse_args()
+    settings.configure(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'TIMEOUT': None}},
+        SPELL_CORRECTION_ENGINES={
+            'biword': {},
+            'deletion': {'max_distance': arguments.max_distance, 'prefix_length': arguments.prefix_length},
+        }
+    )
+
+    vocabulary = synthetic_vocabulary(arguments.words)
+    random = numpy.random.RandomState(1)
+    originals = [vocabulary[i] for i in random.randint(len(vocabulary), size=arguments.queries)]
+    queries = [misspell(word, arguments.edits, random) for word in originals]
+
+    # indexes are built and queried as the service does, through the cache and the version of the index in it
+    # a query counts as corrected when it is brought back to its word
+    # the size of an index is that of the pickle the cache holds
+    print('{:>9} {:>8} {:>9} {:>8} {:>8} {:>10}'.format(
+        'engine', 'build s', 'size MB', 'p50 ms', 'p99 ms', 'corrected'
+    ))
+    for engine in arguments.engines:
+        settings.SPELL_CORRECTION_ENGINE = engine
+        started = time.perf_counter()
+        index_words(vocabulary, reset=True)
+        build_time = time.perf_counter() - started
+        latencies = []
+        corrected = 0
+        for original, query in zip(originals, queries):
+            started = time.perf_counter()
+            correction = correct_spelling(query)
+            latencies.append(time.perf_counter() - started)
+            corrected += correction == original
+        p50, p99 = numpy.percentile(latencies, [50, 99]) * 1000
+        print('{:>9} {:>8.1f} {:>9.1f} {:>8.2f} {:>8.2f} {:>10.3f}'.format(
+            engine, build_time, len(pickle.dumps(cache.get(get_spelling_index_key()))) / 2 ** 20, p50, p99, corrected / len(queries)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Import time and memory of the modules a worker loads: python -m benchmarks.startup --help"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Each measurement runs in a fresh interpreter, which imports the modules and optionally preprocesses a document.
+PROBE = '''
+import json, os, resource, sys, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yaft_preprocessor.settings')
+started = time.perf_counter()
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+import django
+django.setup()
+import importlib
+for module in {modules!r}:
+    importlib.import_module(module)
+imported = time.perf_counter()
+if {language!r}:
+    from yaft_preprocessor.utils.languages import preprocess_document_of_language
+    preprocess_document_of_language({document!r}, {language!r})
+print(json.dumps({{
+    'import': imported - started,
+    'first document': time.perf_counter() - imported,
+    'rss MB': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024,
+    'nlp loaded': any(name in sys.modules for name in ('nltk', 'hazm')),
+}}))
+'''
+
+DOCUMENTS = {
+    'en': 'Hello new world, I am here to tell you interesting things.',
+    'fa': 'سلام دنیای جدید، من اینجا هستم تا چیزهای جالبی بگویم.',
+}
+
+SCENARIOS = {
+    'compression': (['yaft_preprocessor.utils.compression'], None),
+    'views': (['yaft_preprocessor.views'], None),
+    'celery': (['yaft_preprocessor.celery'], None),
+    'preprocess en': (['yaft_preprocessor.views'], 'en'),
+    'preprocess fa': (['yaft_preprocessor.views'], 'fa'),
+}
+
+
+def measure(modules, language):
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(modules=modules, language=language, document=DOCUMENTS.get(language))],
+        check=True, stdout=subprocess.PIPE
+    ).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--runs', type=int, default=3)
+    arguments = parser.parse_args()
+
+    # times are the best of the runs, in seconds; memory is the growth of the peak resident set after startup
+    print('{:>14} {:>9} {:>15} {:>8} {:>11}'.format('scenario', 'import', 'first document', 'rss MB', 'nlp loaded'))
+    for scenario in arguments.scenarios:
+        results = [measure(*SCENARIOS[scenario]) for _ in range(arguments.runs)]
+        print('{:>14} {:>9.3f} {:>15.3f} {:>8.1f} {:>11}'.format(
+            scenario, min(result['import'] for result in results),
+            min(result['first document'] for result in results),
+            max(result['rss MB'] for result in results), str(results[0]['nlp loaded'])
+        ))
+
+
+if __name__ == '__main__':
+    main()
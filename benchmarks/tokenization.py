@@ -0,0 +1,54 @@
+"""Throughput of the preprocessing engines per language: python -m benchmarks.tokenization --help"""
+import argparse
+import time
+
+from django.conf import settings
+
+from benchmarks.preprocessing import synthetic_documents
+from yaft_preprocessor.utils.languages import FUSED, LANGUAGES, REFERENCE, preprocess_document_of_language
+
+ENGINES = (REFERENCE, FUSED)
+
+
+def run(documents, language):
+    return [preprocess_document_of_language(document, language) for document in documents]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=2000)
+    parser.add_argument('--words-per-document', type=int, default=300)
+    parser.add_argument('--languages', nargs='+', choices=LANGUAGES, default=list(LANGUAGES))
+    arguments = parser.parse_args()
+    settings.configure(
+        PREPROCESSING_ENGINE=REFERENCE, NLP_RESOURCES={'offline': False, 'data_path': None},
+        STEM_CACHE={'max_words': 2 ** 17}
+    )
+
+    print('{:>8} {:>10} {:>10} {:>8}'.format('language', 'engine', 'tokens/s', 'speedup'))
+    for language in arguments.languages:
+        documents = list(synthetic_documents(
+            arguments.documents, arguments.words_per_document, language
+        ).values())
+        reference_time = None
+        for engine in ENGINES:
+            settings.PREPROCESSING_ENGINE = engine
+            try:
+                # a first pass loads the resources and warms the stem cache
+                run(documents, language)
+            except LookupError as error:
+                print('{:>8} skipped: {}'.format(language, error))
+                break
+            started = time.perf_counter()
+            result = run(documents, language)
+            elapsed = time.perf_counter() - started
+            if reference_time is None:
+                reference_time = elapsed
+                expected = result
+            assert result == expected, engine
+            tokens = sum(len(words) for words in result)
+            print('{:>8} {:>10} {:>10.0f} {:>8.2f}'.format(language, engine, tokens / elapsed, reference_time / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,41 @@ import django
 django.setup()
 from django.core.cache import caches, cache
 
-from yaft_preprocessor.utils.classification import Classifier
+from yaft_preprocessor.utils.classification import Classifier, get_dataset_version
+from yaft_preprocessor.utils.dataset_store import get_dataset_store
+from yaft_preprocessor.utils.model_store import get_model_keys, load_model, save_model, update_model
 
 app = Celery('tasks', broker='pyamqp://guest@localhost//')
 
 
 @app.task
 def train(key, method, param):
-    print('computing {}'.format(key))
-    classifier = Classifier.factory(method, param)
-    classifier.train()
-    print('setting {}'.format(key))
-    caches['classification'].set(key, classifier)
-    caches['classification'].set('classification_is_under_process', False)
\ No newline at end of file
+    # a failed training must not keep every later one from being scheduled
+    try:
+        classifier = update_model(key)
+        if classifier is None:
+            print('computing {}'.format(key))
+            classifier = Classifier.factory(method, param)
+            classifier.train()
+        print('setting {}'.format(key))
+        save_model(key, classifier)
+    finally:
+        caches['classification'].set('classification_is_under_process', False)
+
+
+@app.task
+def update_models():
+    # models that cannot take new documents stay stale and are retrained on their next request
+    for key in get_model_keys():
+        classifier = load_model(key)
+        if classifier is None or not classifier.incremental or classifier.dataset_version == get_dataset_version():
+            continue
+        print('updating {}'.format(key))
+        if classifier.train_incrementally():
+            save_model(key, classifier)
+
+
+@app.task
+def compact_dataset():
+    # one merge per upload keeps up with uploads, as every merge takes `fan_in` segments for one
+    return get_dataset_store().compact()
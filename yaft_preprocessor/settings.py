@@ -123,6 +123,48 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 
+# NLTK data of the English preprocessor, loaded on first use. It is looked up in `data_path` and NLTK's own
+# paths, and downloaded to `data_path` when missing. In `offline` mode nothing is downloaded and the data must be
+# fetched in advance: python -m nltk.downloader -d <data_path> stopwords punkt
+NLP_RESOURCES = {
+    'offline': False,
+    'data_path': None,
+}
+
+# 'fused' preprocesses documents with the single pass engines of utils/languages.py, which give the words of the
+# 'reference' path.
+PREPROCESSING_ENGINE = 'reference'
+
+# Documents of unknown language are detected from the letters of their first `prefix_length` characters. The
+# language with most letters wins if it has at least `min_share` of them; documents without a winner are `default`.
+LANGUAGE_DETECTION = {
+    'prefix_length': 1000,
+    'min_share': 0.5,
+    'default': 'fa',
+}
+
+# Stems memoized per language by the preprocessor. Processes that serve or preprocess in workers warm the caches at
+# startup with `warm_words`, a UTF-8 file of words as they occur in documents, one per line and most frequent first.
+STEM_CACHE = {
+    'max_words': 2 ** 17,
+    'warm_words': None,
+}
+
+# Index of the indexed words that query words are corrected against. `biword` ranks the words sharing most letter
+# bigrams with a query word, and `deletion` finds the words within `max_distance` edits of the first
+# `prefix_length` letters of it, trading memory for latency on large vocabularies; compare them with
+# `python -m benchmarks.spell_correction`.
+SPELL_CORRECTION_ENGINE = 'biword'
+SPELL_CORRECTION_ENGINES = {
+    'biword': {},
+    'deletion': {
+        'max_distance': 2,
+        'prefix_length': 7,
+    },
+}
+
+CLASSIFICATION_LOCATION = '/var/tmp/yaft_classification'
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
@@ -131,7 +173,75 @@ CACHES = {
     },
     'classification': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': '/var/tmp/yaft_classification',
+        'LOCATION': CLASSIFICATION_LOCATION,
         'TIMEOUT': None,
     }
-}
\ No newline at end of file
+}
+
+# Collected classification documents. Every upload is a segment and `fan_in` neighbouring segments of one size
+# class are merged into one; replaced segment files are deleted `grace` seconds later.
+DATASET_STORE = {
+    'location': os.path.join(CLASSIFICATION_LOCATION, 'dataset'),
+    'fan_in': 8,
+    'grace': 3600,
+}
+
+# Trained classifiers, stored as raw arrays that classify requests memory-map.
+MODEL_STORE_LOCATION = os.path.join(CLASSIFICATION_LOCATION, 'models')
+
+# Bounds of the per-process cache of loaded classifiers.
+MODEL_REGISTRY = {
+    'max_models': 8,
+    'max_bytes': 2 ** 30,
+}
+
+# How `type=auto` picks the codec of every compressed list: the smallest (`size`), or the fastest to decode of
+# those at most `tolerance` larger than the smallest (`speed`).
+COMPRESSION_AUTO = {
+    'criterion': 'size',
+    'tolerance': 0.1,
+}
+
+# Integers per block of compressed values of the blocked layout, which can be decoded a block at a time.
+COMPRESSION_BLOCK_SIZE = 128
+
+# Processes of each worker pool for bulk work, or one per core when None.
+WORKER_POOL = {
+    'workers': None,
+}
+
+# Payloads of at least `min_bytes` of integers, as 64 bit words, or of compressed values are compressed and
+# decompressed across the worker pool.
+BULK_COMPRESSION = {
+    'min_bytes': 2 ** 22,
+}
+
+# Batches of at least `min_documents` documents are preprocessed across the worker pool, in chunks of
+# `chunk_size` documents.
+BULK_PREPROCESSING = {
+    'min_documents': 512,
+    'chunk_size': 64,
+}
+
+# Out-of-core training of the `svm_sgd` and `naivebayes_streaming` classifiers: rows read per batch, and passes
+# over the dataset for SGD.
+STREAMING_TRAINING = {
+    'batch_size': 1024,
+    'epochs': 5,
+}
+
+# Nearest neighbour indexes of the KNN classifier; `knn` uses the approximate `lsh` index and `knn_exact` the
+# `exact` one. For `lsh`, more tables and probes raise recall and latency and more bits make buckets smaller;
+# tune them with `python -m benchmarks.knn`. `memory` bounds the distance block of an exact search in bytes.
+# The metric is either 'euclidean' or 'cosine'.
+KNN_METRIC = 'euclidean'
+KNN_INDEXES = {
+    'lsh': {
+        'tables': 8,
+        'bits': 12,
+        'probes': 8,
+    },
+    'exact': {
+        'memory': 64 * 2 ** 20,
+    },
+}
@@ -1,13 +1,32 @@
+import json
 import random
+import tempfile
+from io import BytesIO
 from time import sleep
 
-from django.core.cache import caches
+import nltk.tokenize
+import numpy
+from django.test import override_settings
+
 from rest_framework.test import APISimpleTestCase
 
-from yaft_preprocessor.utils.classification import Classifier
-from yaft_preprocessor.utils.compression import COMPRESSION_TYPES
-from yaft_preprocessor.utils.languages import process_document_of_unknown_language
-from yaft_preprocessor.utils.spell_correction import get_preprocessed_words_in_order
+from yaft_preprocessor.celery import compact_dataset
+from yaft_preprocessor.utils.classification import Classifier, collect_documents
+from yaft_preprocessor.utils.common import vectors_to_matrix
+from yaft_preprocessor.utils.compression import (
+    AUTO, COMPRESSION_TYPES, VARIABLE_BYTE, BlockedList, compress_lists, decode_gamma, decompress_values, encode_gamma,
+    gaps_to_integers, integers_to_gaps
+)
+from yaft_preprocessor.utils.dataset_store import get_dataset_store
+from yaft_preprocessor.utils.framing import CONTENT_TYPE, decode_integers, encode_frame, encode_integers, read_frames, \
+    write_frames
+from yaft_preprocessor.utils.languages import EN, FA, FUSED, LANGUAGES, LazyResources, get_stem_cache_stats, \
+    get_document_language, preprocess_document_of_language, process_document_of_unknown_language, require_nltk_data, \
+    split_simple_english_document, warm_stem_caches
+from yaft_preprocessor.utils.model_store import get_model_keys, load_model, models, save_model, update_model
+from yaft_preprocessor.utils.preprocess import preprocess_documents
+from yaft_preprocessor.utils.spell_correction import BiwordIndex, DeletionIndex, get_preprocessed_words_in_order, \
+    get_spelling_index, index_words, spelling_indexes
 
 
 class TestPreprocessor(APISimpleTestCase):
@@ -39,6 +58,124 @@ class TestPreprocessor(APISimpleTestCase):
         }, format='json')
         self.assertEqual(response.status_code, 200)
 
+    def test_bulk_preprocessing(self):
+        documents = {
+            str(i): random.choice(['سلام دنیای جدید، من اینجا هستم.', 'Hello new world, I am here.']) * i
+            for i in range(100)
+        }
+        for lang in LANGUAGES:
+            serial_result = preprocess_documents(documents, lang)
+            bulk = {'min_documents': 1, 'chunk_size': 8}
+            with override_settings(WORKER_POOL={'workers': 2}, BULK_PREPROCESSING=bulk):
+                result = preprocess_documents(documents, lang)
+            self.assertListEqual(list(result.items()), list(serial_result.items()))
+
+    def test_streaming_preprocessing(self):
+        documents = {
+            '1': 'سلام دنیای جدید، من اینجا هستم تا چیزهای جالبی بگویم.',
+            '2': 'این پرس‌وجوی فارسی باید نسبت به یافتن کلمات اصلی مقاوم باشد.',
+        }
+        expected = self.client.post('/api/v1/preprocess_documents?lang=fa', data={
+            'documents': documents
+        }, format='json').json()
+        response = self.client.post(
+            '/api/v1/preprocess_documents?lang=fa',
+            data='\n'.join(json.dumps({'id': key, 'document': document}) for key, document in documents.items()),
+            content_type='application/x-ndjson'
+        )
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertDictEqual({line['id']: line['words'] for line in lines}, expected)
+        response = self.client.post(
+            '/api/v1/preprocess_documents?lang=fa', data='{"id": 1}\n', content_type='application/x-ndjson'
+        )
+        self.assertIn('error', json.loads(b''.join(response.streaming_content)))
+
+    def test_fused_engine(self):
+        documents = {
+            FA: ['سلام دنیای جدید، من اینجا هستم تا چیزهای جالبی بگویم.', 'پرس‌وجوی «فارسی» - ۱۲ کلمه!', ''],
+            EN: ['Hello new world, I am here to tell you interesting things.', 'I cannot: (wanna) "go"!',
+                 "It's 3.5 km, isn't it? Mr. Smith's e-mail.", 'a,:b'],
+        }
+        # the English fast path against the word tokenizers, which need no NLTK data
+        tokenizers = [
+            getattr(nltk.tokenize, name)() for name in ('TreebankWordTokenizer', 'NLTKWordTokenizer')
+            if hasattr(nltk.tokenize, name)
+        ]
+        pieces = ['hello', 'cannot', 'gonna', 'wanna', 'gimme', 'a', 'i', 'xcannot'] + list(',;:!?()[]{}".') + \
+            [' ', '\n', '\t']
+        random_state = random.Random(0)
+        simple = 0
+        for _ in range(5000):
+            document = ''.join(random_state.choice(pieces) for _ in range(random_state.randint(0, 10)))
+            words = split_simple_english_document(document)
+            if words is None:
+                continue
+            simple += 1
+            for tokenizer in tokenizers:
+                tokens = [token for token in tokenizer.tokenize(document) if token.isalpha()]
+                self.assertListEqual(words, tokens, msg=repr(document))
+        self.assertGreater(simple, 1000)
+
+        with override_settings(PREPROCESSING_ENGINE=FUSED):
+            fused = [preprocess_document_of_language(text, FA) for text in documents[FA]]
+        self.assertListEqual(fused, [preprocess_document_of_language(text, FA) for text in documents[FA]])
+        try:
+            expected = [preprocess_document_of_language(text, EN) for text in documents[EN]]
+        except LookupError:
+            self.skipTest('NLTK data of the English preprocessor is missing.')
+        with override_settings(PREPROCESSING_ENGINE=FUSED):
+            self.assertListEqual([preprocess_document_of_language(text, EN) for text in documents[EN]], expected)
+
+    def test_language_detection(self):
+        self.assertEqual(get_document_language('Hello دنیا, new world'), EN)
+        self.assertEqual(get_document_language('1 دنیای جدید، new'), FA)
+        with override_settings(LANGUAGE_DETECTION={'prefix_length': 1000, 'min_share': 0.5, 'default': EN}):
+            self.assertEqual(get_document_language('۱۲ - 34'), EN)
+            self.assertEqual(get_document_language(''), EN)
+        response = self.client.post('/api/v1/detect_languages', data={
+            'documents': {'1': 'سلام دنیا world', '2': 'Hello 🌍', '3': ''}
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertDictEqual({key: value['language'] for key, value in result.items()}, {'1': FA, '2': EN, '3': FA})
+        self.assertDictEqual(result['2']['ratios'], {FA: 0.0, EN: 5 / 7})
+        response = self.client.post('/api/v1/detect_languages', data={'documents': ['text']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_stem_cache(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+            f.write('Worlds\njumping\n\n')
+            f.flush()
+            with override_settings(STEM_CACHE={'max_words': 2 ** 17, 'warm_words': f.name}):
+                warm_stem_caches()
+        hits = get_stem_cache_stats()[EN]['hits']
+        self.assertDictEqual(process_document_of_unknown_language('worlds jumping'), {0: 'world', 1: 'jump'})
+        self.assertEqual(get_stem_cache_stats()[EN]['hits'], hits + 2)
+
+    def test_stem_cache_warming(self):
+        # only half the cache is warmed
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', encoding='utf-8') as f:
+            f.write('گلدانهایمانسک\nپنجرههایتانسک\nدیوارهایشانسک\n')
+            f.flush()
+            misses = get_stem_cache_stats().get(FA, {'misses': 0})['misses']
+            with override_settings(STEM_CACHE={'max_words': 4, 'warm_words': f.name}):
+                warm_stem_caches()
+        self.assertEqual(get_stem_cache_stats()[FA]['misses'], misses + 2)
+        hits = get_stem_cache_stats()[FA]['hits']
+        process_document_of_unknown_language('گلدانهایمانسک پنجرههایتانسک')
+        self.assertEqual(get_stem_cache_stats()[FA]['hits'], hits + 2)
+
+    def test_lazy_resources(self):
+        loads = []
+        resources = LazyResources({FA: lambda: loads.append(FA) or len(loads)})
+        self.assertListEqual(loads, [])
+        self.assertEqual(resources[FA], 1)
+        self.assertEqual(resources[FA], 1)
+        self.assertListEqual(loads, [FA])
+        with override_settings(NLP_RESOURCES={'offline': True, 'data_path': None}):
+            with self.assertRaises(LookupError):
+                require_nltk_data('corpora/yaft_missing', 'yaft_missing')
+
 
 class TestCompression(APISimpleTestCase):
 
@@ -77,6 +214,132 @@ class TestCompression(APISimpleTestCase):
             print(compressed_number_of_bytes, fixed_length_number_of_bytes, compression_type)
             self.assertLess(compressed_number_of_bytes, fixed_length_number_of_bytes, msg=compression_type)
 
+    def test_auto_compression(self):
+        integer_lists = {
+            'dense': list(range(200)),
+            'sparse': sorted(random.sample(range(10 ** 8), 2000)),
+            'short': [5, 25, 86, 92, 100054, 100064],
+        }
+        compressed_values = compress_lists(integer_lists, AUTO)
+        self.assertDictEqual(decompress_values(compressed_values, AUTO), integer_lists)
+        for compression_type in COMPRESSION_TYPES:
+            for key, compressed_value in compress_lists(integer_lists, compression_type).items():
+                # plus the codec id byte
+                self.assertLessEqual(len(compressed_values[key]), len(compressed_value) + 2)
+
+    def test_blocked_layout(self):
+        integer_lists = {
+            'dense': list(range(1000)),
+            'sparse': sorted(random.sample(range(10 ** 6), 3000)),
+            'short': [5, 25, 86, 92, 100054, 100064],
+        }
+        for compression_type in COMPRESSION_TYPES:
+            response = self.client.post('/api/v1/compress?type={}&layout=blocked'.format(compression_type), data={
+                'integer_lists': integer_lists
+            }, format='json')
+            compressed_values = response.json()
+            response = self.client.post('/api/v1/decompress?type={}&layout=blocked'.format(compression_type), data={
+                'compressed_values': compressed_values
+            }, format='json')
+            self.assertDictEqual(response.json(), integer_lists)
+            response = self.client.post('/api/v1/intersect?type={}'.format(compression_type), data={
+                'compressed_values': list(compressed_values.values())[:2]
+            }, format='json')
+            self.assertListEqual(
+                response.json()['integers'], sorted(set(integer_lists['dense']) & set(integer_lists['sparse']))
+            )
+            blocked_list = BlockedList(bytes.fromhex(compressed_values['sparse']), compression_type)
+            for target in sorted(random.sample(range(10 ** 6), 100)):
+                following = [i for i in integer_lists['sparse'] if i >= target]
+                self.assertEqual(blocked_list.next_geq(target), following[0] if following else None)
+
+    def test_bulk_compression(self):
+        integer_lists = {str(i): sorted(random.sample(range(10 ** 5), random.randint(1, 500))) for i in range(200)}
+        for compression_type in COMPRESSION_TYPES:
+            serial_values = compress_lists(integer_lists, compression_type)
+            with override_settings(WORKER_POOL={'workers': 2}, BULK_COMPRESSION={'min_bytes': 1}):
+                compressed_values = compress_lists(integer_lists, compression_type)
+                self.assertDictEqual(decompress_values(compressed_values, compression_type), integer_lists)
+            self.assertListEqual(list(compressed_values.items()), list(serial_values.items()))
+
+    def test_gaps(self):
+        integers = numpy.array([0, 3, 4, 100])
+        self.assertListEqual(integers_to_gaps(integers).tolist(), [1, 3, 1, 96])
+        self.assertListEqual(gaps_to_integers(integers_to_gaps(integers)).tolist(), integers.tolist())
+        for integers in ([], [3, 2], [1, 1], [-1, 3]):
+            with self.assertRaises(ValueError):
+                compress_lists({'1': integers}, VARIABLE_BYTE)
+        response = self.client.post(
+            '/api/v1/compress?type=varbyte', data={'integer_lists': {'1': [3, 2]}}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+        response = self.client.post(
+            '/api/v1/decompress?type=gamma', data={'compressed_values': {'1': 'zz'}}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        # a count of about 2 ** 42 integers in 7 bytes
+        for compression_type in ('pfordelta', AUTO):
+            value = '91f294c4e0fe65' if compression_type == 'pfordelta' else '04' + '91f294c4e0fe65'
+            response = self.client.post(
+                '/api/v1/decompress?type={}'.format(compression_type), data={'compressed_values': {'1': value}},
+                format='json'
+            )
+            self.assertEqual(response.status_code, 400, msg=compression_type)
+
+    def test_gamma_wire_format(self):
+        # written by the original bitstring implementation
+        integers = [1, 2, 3, 4, 5, 100, 1000, 70000]
+        self.assertEqual(encode_gamma(integers).hex(), '01f92e33fa4ffbd1fffe1170')
+        self.assertListEqual(decode_gamma(bytes.fromhex('01f92e33fa4ffbd1fffe1170')).tolist(), integers)
+        integers = [random.randint(1, 2 ** random.randint(0, 40)) for _ in range(100000)]
+        self.assertListEqual(decode_gamma(encode_gamma(integers)).tolist(), integers)
+        integers += [2 ** 63, 2 ** 70 + 1]
+        self.assertListEqual(decode_gamma(encode_gamma(integers)), integers)
+
+    def test_binary_transport(self):
+        integer_lists = {
+            '1': list(range(101)),
+            '2': [5, 25, 86, 92, 100054, 100064],
+        }
+        for compression_type in COMPRESSION_TYPES:
+            response = self.client.post(
+                '/api/v1/compress?type={}'.format(compression_type),
+                data=b''.join(write_frames(
+                    (key, encode_integers(integers)) for key, integers in integer_lists.items()
+                )),
+                content_type=CONTENT_TYPE
+            )
+            self.assertEqual(response['Content-Type'], CONTENT_TYPE)
+            compressed_values = dict(read_frames(BytesIO(b''.join(response.streaming_content))))
+            self.assertDictEqual(
+                {key: value.hex() for key, value in compressed_values.items()},
+                compress_lists(integer_lists, compression_type)
+            )
+            response = self.client.post(
+                '/api/v1/decompress?type={}'.format(compression_type),
+                data=b''.join(write_frames(compressed_values.items())),
+                content_type=CONTENT_TYPE
+            )
+            integers = dict(read_frames(BytesIO(b''.join(response.streaming_content))))
+            self.assertDictEqual(
+                {key: decode_integers(value).tolist() for key, value in integers.items()}, integer_lists
+            )
+
+        # a corrupt frame in the middle of a stream ends the response with an error frame, after the frames before it
+        frames = [('1', encode_integers([1, 2])), ('2', encode_integers([3, 2])), ('3', encode_integers([4]))]
+        response = self.client.post(
+            '/api/v1/compress?type=varbyte', data=b''.join(write_frames(frames)), content_type=CONTENT_TYPE
+        )
+        received = []
+        with self.assertRaisesRegex(ValueError, 'increasing'):
+            for key, value in read_frames(BytesIO(b''.join(response.streaming_content))):
+                received.append(key)
+        self.assertListEqual(received, ['1'])
+        # as is a request or response cut short on a frame boundary
+        with self.assertRaises(ValueError):
+            list(read_frames(BytesIO(b''.join(encode_frame(key, value) for key, value in frames))))
+
 
 class TestQueryPreprocess(APISimpleTestCase):
 
@@ -137,6 +400,49 @@ class TestQueryPreprocess(APISimpleTestCase):
             )
 
 
+    def test_biword_index(self):
+        index = BiwordIndex()
+        index.index_words(['abd', 'aaa', 'xyz'])
+        index.index_words(['abd', 'abc'])
+        self.assertDictEqual(index.jaccard_lookup('abc'), {'abd': 1 / 3, 'aaa': 1 / 6, 'abc': 1.0})
+        self.assertDictEqual(index.jaccard_lookup('aa'), {'abd': 1 / 6, 'aaa': 1.0, 'abc': 1 / 6})
+        self.assertEqual(index.correct('abx'), 'abd')
+        self.assertEqual(index.correct('qq'), 'qq')
+
+    def test_spelling_index_per_process(self):
+        index_words(['دنیا'], reset=True)
+        spelling_index = get_spelling_index()
+        self.assertIs(get_spelling_index(), spelling_index)
+        index_words(['جدید'])
+        self.assertIsNot(get_spelling_index(), spelling_index)
+        self.assertListEqual(get_spelling_index().words, ['دنیا', 'جدید'])
+        # as in a process that has not loaded the index yet
+        spelling_indexes.clear()
+        self.assertListEqual(get_spelling_index().words, ['دنیا', 'جدید'])
+
+    def test_deletion_index(self):
+        index = DeletionIndex(max_distance=2, prefix_length=7)
+        index.index_words(['دنیا', 'جدید', 'publication', 'public', 'world'])
+        index.index_words(['world', 'word'])
+        self.assertEqual(index.correct('publicaiton'), 'publication')
+        self.assertEqual(index.correct('dnya'), 'dnya')
+        self.assertEqual(index.correct('دنا'), 'دنیا')
+        self.assertEqual(index.correct('wrd'), 'word')
+        self.assertEqual(index.correct('word'), 'word')
+        self.assertEqual(index.correct('xyzzy'), 'xyzzy')
+        # words longer than the prefix share variants with words 3 edits away
+        index.index_words(['abcdefgh'])
+        self.assertEqual(index.correct('abcdefgxyz'), 'abcdefgxyz')
+        self.assertEqual(index.correct('abcdefghxyz'), 'abcdefghxyz')
+        self.assertEqual(index.correct('abcdefghx'), 'abcdefgh')
+        self.assertEqual(len(index.words), 7)
+        engines = {'biword': {}, 'deletion': {'max_distance': 2, 'prefix_length': 7}}
+        with override_settings(SPELL_CORRECTION_ENGINE='deletion', SPELL_CORRECTION_ENGINES=engines):
+            index_words(['جدید', 'دنیا'], reset=True)
+            response = self.client.post('/api/v1/preprocess_query', data={'query': 'دنیای جدد'}, format='json')
+            self.assertListEqual(response.json(), ['دنیا', 'جدید'])
+
+
 class TestClassification(APISimpleTestCase):
 
     def test_svm_classifier(self):
@@ -292,6 +598,17 @@ class TestClassification(APISimpleTestCase):
             {str(i): i for i in range(1, 4)}
         )
 
+    def test_naive_bayes_negative_weights(self):
+        x = vectors_to_matrix([{0: 1, 1: 0}, {0: 0, 1: 1}, {0: -1, 1: -1}], 2)
+        classifier = Classifier.factory('naivebayes', 1.0)
+        classifier.n = 2
+        with self.assertRaises(ValueError):
+            classifier.train_using_training_set(x, numpy.array([1, 2, 3]))
+        classifier.train_using_training_set(x[:2], numpy.array([1, 2]))
+        self.assertFalse(classifier.update(x, numpy.array([1, 2, 3])))
+        legacy = Classifier.factory('naivebayes_legacy', 1.0)
+        legacy.train_using_training_set(x, numpy.array([1, 2, 3]))
+
     def test_knn_classifier(self):
         # response = self.client.post(
         #     '/api/v1/collect_data_set?reset=true',
@@ -307,8 +624,10 @@ class TestClassification(APISimpleTestCase):
         # )
         # self.assertEqual(response.status_code, 200)
 
-        training_set = caches['classification'].get('classification_dataset', [])
-        test_set = training_set[:100]
+        x, _ = get_dataset_store().read()
+        test_set = [
+            {'vector': dict(zip(map(str, row.indices.tolist()), row.data.tolist()))} for row in x[:100]
+        ]
         response = None
         while not response or response.status_code in (202, 204):
             response = self.client.post(
@@ -331,6 +650,212 @@ class TestClassification(APISimpleTestCase):
         #     {str(i): i for i in range(1, 4)}
         # )
 
+    def test_exact_knn_classifier(self):
+        response = self.client.post(
+            '/api/v1/collect_data_set?reset=true',
+            data={'vectors': [
+                {
+                    'vector': {0: 1, 1: 0},
+                    'class': 1
+                },
+                {
+                    'vector': {0: 0, 1: 1},
+                    'class': 2
+                },
+                {
+                    'vector': {0: -1, 1: -1},
+                    'class': 3
+                },
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = None
+        while not response or response.status_code in (202, 204):
+            response = self.client.post(
+                '/api/v1/classify?method=knn_exact&param=1.0',
+                data={
+                    'vectors': [
+                        {
+                            'vector': {0: 100, 1: 0},
+                            'id': 1,
+                        },
+                        {
+                            'vector': {0: 0, 1: 1000},
+                            'id': 2,
+                        },
+                        {
+                            'vector': {0: -2, 1: -2},
+                            'id': 3,
+                        }
+                    ]
+                },
+                format='json'
+            )
+            sleep(1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(
+            response.json(),
+            {str(i): i for i in range(1, 4)}
+        )
+
+
+    @override_settings(STREAMING_TRAINING={'batch_size': 2, 'epochs': 20})
+    def test_streaming_classifiers(self):
+        response = self.client.post(
+            '/api/v1/collect_data_set?reset=true',
+            data={'vectors': [
+                {
+                    'vector': {0: 1, 1: 0, 2: 0},
+                    'class': 1
+                },
+                {
+                    'vector': {0: 0, 1: 1, 2: 0},
+                    'class': 2
+                },
+                {
+                    'vector': {0: 0, 1: 0, 2: 1},
+                    'class': 3
+                },
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        for method in ('svm_sgd', 'naivebayes_streaming'):
+            classifier = Classifier.factory(method, 1.0)
+            classifier.train()
+            self.assertDictEqual(
+                classifier.classify_documents([
+                    {'vector': {str(i): 1}, 'id': i + 1} for i in range(3)
+                ]),
+                {i: i for i in range(1, 4)}
+            )
+
+
+class TestModelStore(APISimpleTestCase):
+
+    def test_save_and_load(self):
+        response = self.client.post(
+            '/api/v1/collect_data_set?reset=true',
+            data={'vectors': [
+                {
+                    'vector': {0: 1, 1: 0, 2: 0},
+                    'class': 1
+                },
+                {
+                    'vector': {0: 0, 1: 1, 2: 0},
+                    'class': 2
+                },
+                {
+                    'vector': {0: 0, 1: 0, 2: 1},
+                    'class': 3
+                },
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        documents = [{'vector': {str(i): 1}, 'id': i} for i in range(3)]
+        for method in ('svm', 'rndfrst', 'naivebayes', 'knn', 'knn_exact'):
+            classifier = Classifier.factory(method, 1.0)
+            classifier.train()
+            key = 'classifier:{}:1.0'.format(method)
+            save_model(key, classifier)
+            self.assertDictEqual(
+                load_model(key).classify_documents(documents),
+                classifier.classify_documents(documents),
+                msg=method
+            )
+        self.assertIsNone(load_model('classifier:unknown:1.0'))
+
+    def test_empty_batch(self):
+        collect_documents([{'vector': {str(i): 1}, 'class': i} for i in range(3)], True)
+        for method in ('svm', 'rndfrst', 'naivebayes', 'knn', 'svm_sgd', 'naivebayes_streaming'):
+            classifier = Classifier.factory(method, 1.0)
+            classifier.train()
+            self.assertDictEqual(classifier.classify_documents([]), {}, msg=method)
+
+    def test_registry_invalidation(self):
+        vectors = [
+            {
+                'vector': {0: 1, 1: 0},
+                'class': 1
+            },
+            {
+                'vector': {0: 0, 1: 1},
+                'class': 2
+            },
+        ]
+        self.client.post('/api/v1/collect_data_set?reset=true', data={'vectors': vectors}, format='json')
+        classifier = Classifier.factory('svm', 1.0)
+        classifier.train()
+        save_model('classifier:svm:1.0', classifier)
+        hits = models.get_stats()['hits']
+        self.assertIsNotNone(models.get('classifier:svm:1.0'))
+        self.assertIsNotNone(models.get('classifier:svm:1.0'))
+        self.assertEqual(models.get_stats()['hits'], hits + 1)
+
+        self.client.post('/api/v1/collect_data_set', data={'vectors': vectors}, format='json')
+        self.assertIsNone(models.get('classifier:svm:1.0'))
+        stats = self.client.get('/api/v1/stats').json()
+        self.assertIn('models', stats)
+        self.assertIn('stem_cache', stats)
+
+        self.client.post('/api/v1/collect_data_set?reset=true', data={'vectors': vectors}, format='json')
+        self.assertListEqual(get_model_keys(), [])
+
+    def test_incremental_update(self):
+        collect_documents([{'vector': {str(i): 1}, 'class': i} for i in range(3)], True)
+        for method in ('svm', 'naivebayes', 'knn', 'knn_exact'):
+            classifier = Classifier.factory(method, 1.0)
+            classifier.train()
+            save_model('classifier:{}:1.0'.format(method), classifier)
+        collect_documents([{'vector': {str(i): 2}, 'class': i} for i in range(2, 5)], False)
+
+        self.assertIsNone(update_model('classifier:svm:1.0'))
+        documents = [{'vector': {str(i): 1}, 'id': i} for i in range(5)]
+        for method in ('naivebayes', 'knn', 'knn_exact'):
+            classifier = update_model('classifier:{}:1.0'.format(method))
+            self.assertEqual(classifier.dataset_version, get_dataset_store().get_version())
+            self.assertDictEqual(classifier.classify_documents(documents), {i: i for i in range(5)}, msg=method)
+
+
+class TestDatasetStore(APISimpleTestCase):
+
+    def test_append_and_compact(self):
+        dataset_store = get_dataset_store()
+        for i in range(2 * dataset_store.fan_in + 1):
+            response = self.client.post(
+                '/api/v1/collect_data_set{}'.format('?reset=true' if i == 0 else ''),
+                data={'vectors': [
+                    {
+                        'vector': {i: 1},
+                        'class': i,
+                    },
+                ]},
+                format='json'
+            )
+            self.assertEqual(response.status_code, 200)
+            # uploads only append; the task, run here in process, merges
+            segments = dataset_store.read_manifest()['segments']
+            self.assertEqual(len(segments), i % dataset_store.fan_in + 1 + i // dataset_store.fan_in)
+            compact_dataset()
+        manifest = dataset_store.read_manifest()
+        self.assertEqual([segment['level'] for segment in manifest['segments']], [1, 1, 0])
+        x, y = dataset_store.read()
+        self.assertListEqual(y.tolist(), list(range(2 * dataset_store.fan_in + 1)))
+        self.assertListEqual(x.toarray().tolist(), numpy.eye(2 * dataset_store.fan_in + 1).tolist())
+
+        # a reset leaves the documents of an earlier manifest to its readers
+        response = self.client.post(
+            '/api/v1/collect_data_set?reset=true', data={'vectors': [{'vector': {0: 1}, 'class': 0}]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(dataset_store.read(manifest)[1].tolist(), list(range(2 * dataset_store.fan_in + 1)))
+        self.assertListEqual(dataset_store.read()[1].tolist(), [0])
+
 
 class TestClustering(APISimpleTestCase):
 
@@ -356,6 +881,28 @@ class TestClustering(APISimpleTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(set(response.json().values())), 3)
 
+    def test_minibatchkmeans(self):
+        response = self.client.post(
+            '/api/v1/cluster?method=minibatchkmeans&k=3',
+            data={'vectors': [
+                {
+                    'vector': {0: 1, 1: 0},
+                    'id': 1
+                },
+                {
+                    'vector': {0: 0, 1: 1},
+                    'id': 2
+                },
+                {
+                    'vector': {0: -1, 1: -1},
+                    'id': 3
+                },
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(set(response.json().values())), 3)
+
     def test_gmm(self):
         response = self.client.post(
             '/api/v1/cluster?method=gmm&k=3',
@@ -17,16 +17,20 @@ from django.contrib import admin
 from django.urls import path
 
 from yaft_preprocessor.views import PreprocessView, CompressView, DecompressView, IndexWordsView, PreprocessQueryView, \
-    CollectDataSetView, ClassifyView, ClusterView
+    CollectDataSetView, ClassifyView, ClusterView, StatsView, IntersectView, \
+    DetectLanguagesView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/preprocess_documents', PreprocessView.as_view()),
     path('api/v1/compress', CompressView.as_view()),
     path('api/v1/decompress', DecompressView.as_view()),
+    path('api/v1/intersect', IntersectView.as_view()),
+    path('api/v1/detect_languages', DetectLanguagesView.as_view()),
     path('api/v1/index_words', IndexWordsView.as_view()),
     path('api/v1/preprocess_query', PreprocessQueryView.as_view()),
     path('api/v1/collect_data_set', CollectDataSetView.as_view()),
     path('api/v1/classify', ClassifyView.as_view()),
     path('api/v1/cluster', ClusterView.as_view()),
+    path('api/v1/stats', StatsView.as_view()),
 ]
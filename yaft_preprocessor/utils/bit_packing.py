@@ -0,0 +1,109 @@
+import numpy
+
+# Bit streams are written most significant bit first, as a sequence of (value, width) fields packed into
+# 64 bit words. Widths are at most 64, and values are unsigned and fit their width.
+WORD = numpy.uint64(64)
+
+
+def as_unsigned(array):
+    return numpy.asarray(array, dtype=numpy.uint64)
+
+
+def bit_lengths(values):
+    # exact for int64 values: the float exponent can only be one too large, where rounding reached a power of two
+    values = numpy.asarray(values, dtype=numpy.int64)
+    lengths = numpy.frexp(values.astype(numpy.float64))[1].astype(numpy.int64)
+    too_long = lengths > 0
+    too_long[too_long] = (values[too_long] >> (lengths[too_long] - 1)) == 0
+    return lengths - too_long
+
+
+def pack(values, widths, offset=0):
+    # the fields follow `offset` zero bits, and the stream is zero padded to whole bytes
+    values = as_unsigned(values)
+    widths = numpy.asarray(widths, dtype=numpy.int64)
+    ends = numpy.cumsum(widths) + offset
+    total = int(ends[-1]) if len(ends) else offset
+    words = numpy.zeros(total // 64 + 2, dtype=numpy.uint64)
+    starts = ends - widths
+    indices = starts >> 6
+    ends = as_unsigned((starts & 63) + widths)
+    fits = ends <= WORD
+    # a field that crosses into the next word leaves its low bits there; only the last field of a word can
+    high = numpy.where(
+        fits, values << (WORD - ends).clip(max=63), values >> (ends - WORD).clip(min=0, max=63)
+    )
+    boundaries = numpy.flatnonzero(numpy.diff(indices, prepend=-1))
+    if len(boundaries):
+        words[indices[boundaries]] = numpy.bitwise_or.reduceat(high, boundaries)
+    spilled = ~fits
+    words[indices[spilled] + 1] |= values[spilled] << (numpy.uint64(128) - ends[spilled])
+    return words.astype('>u8').tobytes()[:(total + 7) // 8]
+
+
+def unpack(data):
+    return numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8))
+
+
+def padded(data):
+    # the bytes of a stream as `read` takes them
+    return numpy.frombuffer(bytes(data) + bytes(9), dtype=numpy.uint8)
+
+
+def read(padded, positions, widths):
+    # the fields of the given widths at the given bit positions of a padded stream; positions past its end read
+    # meaningless values rather than failing, so that callers can read speculatively
+    positions = numpy.asarray(positions, dtype=numpy.int64)
+    widths = as_unsigned(widths)
+    first = numpy.minimum(positions >> 3, len(padded) - 9)
+    words = numpy.zeros(len(positions), dtype=numpy.uint64)
+    for i in range(8):
+        words = (words << numpy.uint64(8)) | padded[first + i]
+    shifts = as_unsigned(positions & 7)
+    words = (words << shifts) | (padded[first + 8].astype(numpy.uint64) >> (numpy.uint64(8) - shifts))
+    return numpy.where(widths > 0, words >> (WORD - widths).clip(max=63), numpy.uint64(0))
+
+
+def next_zeros(bits):
+    # the position of the first zero bit at or after every position, or len(bits) if there is none
+    positions = numpy.where(bits == 0, numpy.arange(len(bits)), len(bits))
+    return numpy.minimum.accumulate(positions[::-1])[::-1]
+
+
+def walk(bits, position, code_lengths, size=2 ** 20):
+    # Finds the consecutive self delimiting codes from bit `position` to the end of `bits`, a chunk of bits at
+    # a time. `code_lengths(start, offsets, zeros)` gives the length of a code at each offset of the chunk
+    # starting at bit `start`, where `zeros` are the offsets of the first zero at or after each. Returns the
+    # start of every code and of the first zero at or after it.
+    starts = []
+    zeros = []
+    while position < len(bits):
+        chunk = bits[position:position + size]
+        offsets = numpy.arange(len(chunk))
+        chunk_zeros = next_zeros(chunk)
+        following = offsets + code_lengths(position, offsets, chunk_zeros)
+        # codes that do not end within the chunk lead just past it
+        following[following > len(chunk)] = len(chunk) + 1
+        # the walk is the only per code step, so it reads the array through a memoryview of plain ints
+        following = following.astype(numpy.int64).data
+        chunk_starts = []
+        append = chunk_starts.append
+        start = 0
+        end = len(chunk)
+        while start < end:
+            append(start)
+            start = following[start]
+        if start > end:
+            start = chunk_starts.pop()
+            if position + end == len(bits):
+                raise ValueError('Compressed value ends within a code.')
+            if not start:
+                size *= 2
+                continue
+        chunk_starts = numpy.array(chunk_starts, dtype=numpy.int64)
+        starts.append(chunk_starts + position)
+        zeros.append(chunk_zeros[chunk_starts] + position)
+        position += start
+    if not starts:
+        return numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.int64)
+    return numpy.concatenate(starts), numpy.concatenate(zeros)
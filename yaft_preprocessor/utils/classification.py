@@ -1,68 +1,105 @@
+import pickle
 from abc import abstractmethod
 
+import numpy
 from sklearn.svm import LinearSVC
 from sklearn.ensemble import RandomForestClassifier as SKRandomForestClassifier
 
-from django.core.cache import caches
-
-from yaft_preprocessor.utils.common import expend_vector_of_size
+from yaft_preprocessor.utils.common import Persistent, vectors_to_matrix
+from yaft_preprocessor.utils.dataset_store import get_dataset_store
 
 
 def collect_documents(documents, reset):
-    classification_dataset = [] if reset else caches['classification'].get('classification_dataset', [])
-    classification_dataset.extend(documents)
-    caches['classification'].set('classification_dataset', classification_dataset)
+    # segments are merged by the compact_dataset task, so an upload only pays for its own documents
+    get_dataset_store().append(documents, reset)
+
 
+def get_dataset_version():
+    return get_dataset_store().get_version()
 
-class Classifier:
+
+class Classifier(Persistent):
+    persistent_attributes = ('n', 'dataset_version')
+    # Incremental classifiers take documents collected after training through `update` instead of retraining.
+    incremental = False
 
     @staticmethod
     def factory(method, param):
         from yaft_preprocessor.utils.knn_classifier import KNNClassifier
         from .naive_base_classifier import NaiveBayesClassifier
+        from .streaming_classifier import SGDSVMClassifier, StreamingNaiveBayesClassifier
         if method == 'svm':
             return SVMClassifier(method, param)
         if method == 'rndfrst':
             return RandomForestClassifier(method, param)
         if method == 'naivebayes':
             return NaiveBayesClassifier(method, param)
+        if method == 'naivebayes_legacy':
+            return NaiveBayesClassifier(method, param, legacy=True)
         if method == 'knn':
             return KNNClassifier(method, param)
+        if method == 'knn_exact':
+            return KNNClassifier(method, param, index='exact')
+        if method == 'svm_sgd':
+            return SGDSVMClassifier(method, param)
+        if method == 'naivebayes_streaming':
+            return StreamingNaiveBayesClassifier(method, param)
 
     def __init__(self, method: str, param: float) -> None:
         self.method = method
         self.param = param
         self.n = None
+        self.dataset_version = None
         super().__init__()
 
     @abstractmethod
-    def classify_document(self, document) -> int:
+    def classify_matrix(self, x):
         raise NotImplemented
 
-    def classify_documents(self, documents: dict):
-        result = {}
-        for i, document in enumerate(documents):
-            if i % 100 == 0:
-                print(i)
-            result[document['id']] = self.classify_document(document['vector'])
-        return result
+    def classify_document(self, document) -> int:
+        return self.classify_matrix(self.expand_vector(document))[0]
+
+    def classify_documents(self, documents: list):
+        ids = [document['id'] for document in documents]
+        if not ids:
+            return {}
+        x = vectors_to_matrix((document['vector'] for document in documents), self.n)
+        return dict(zip(ids, self.classify_matrix(x).tolist()))
 
     def train(self):
-        training_set = caches['classification'].get('classification_dataset', [])
-        self.n = max(max(map(int, document['vector'].keys())) for document in training_set) + 1
-        x = []
-        y = []
-        for document in training_set:
-            x.append(self.expand_vector(document['vector']))
-            y.append(int(document['class']))
+        dataset_store = get_dataset_store()
+        manifest = dataset_store.read_manifest()
+        x, y = dataset_store.read(manifest)
+        self.dataset_version = manifest['version']
+        self.n = x.shape[1]
         self.train_using_training_set(x, y)
 
     @abstractmethod
     def train_using_training_set(self, x, y):
         raise NotImplemented
 
+    def train_incrementally(self):
+        # Brings a trained model up to the current dataset, or returns False when it has to be retrained.
+        if not self.incremental:
+            return False
+        dataset_store = get_dataset_store()
+        manifest = dataset_store.read_manifest()
+        collected = dataset_store.read_since(self.dataset_version, manifest)
+        if collected is None:
+            return False
+        x, y = collected
+        if x.shape[0] and not self.update(x, y):
+            return False
+        self.dataset_version = manifest['version']
+        self.n = x.shape[1]
+        return True
+
+    def update(self, x, y):
+        # `x` has at least `n` columns; returns False when the documents cannot be taken in
+        raise NotImplemented
+
     def expand_vector(self, positional_vector):
-        return expend_vector_of_size(positional_vector, self.n)
+        return vectors_to_matrix([positional_vector], self.n)
 
 
 class SVMClassifier(Classifier):
@@ -70,12 +107,26 @@ class SVMClassifier(Classifier):
     def train_using_training_set(self, x, y):
         self.classifier.fit(x, y)
 
+    def get_state(self):
+        state = super().get_state()
+        state.update(
+            coef=self.classifier.coef_, intercept=self.classifier.intercept_, classes=self.classifier.classes_
+        )
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.classifier.coef_ = state['coef']
+        self.classifier.intercept_ = state['intercept']
+        self.classifier.classes_ = state['classes']
+        self.classifier.n_features_in_ = self.n
+
     def __init__(self, method: str, param: float) -> None:
         super().__init__(method, param)
         self.classifier = LinearSVC(C=self.param)
 
-    def classify_document(self, document) -> int:
-        return self.classifier.predict([self.expand_vector(document)])[0]
+    def classify_matrix(self, x):
+        return self.classifier.predict(x)
 
 
 class RandomForestClassifier(Classifier):
@@ -83,9 +134,19 @@ class RandomForestClassifier(Classifier):
     def train_using_training_set(self, x, y):
         self.classifier.fit(x, y)
 
+    # The trees have no flat array form, so the fitted forest is kept as a pickled byte array.
+    def get_state(self):
+        state = super().get_state()
+        state['estimator'] = numpy.frombuffer(pickle.dumps(self.classifier), dtype=numpy.uint8)
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.classifier = pickle.loads(state['estimator'].tobytes())
+
     def __init__(self, method: str, param: float) -> None:
         super().__init__(method, param)
         self.classifier = SKRandomForestClassifier()
 
-    def classify_document(self, document) -> int:
-        return self.classifier.predict([self.expand_vector(document)])[0]
+    def classify_matrix(self, x):
+        return self.classifier.predict(x)
@@ -1,19 +1,30 @@
-from sklearn.cluster import KMeans, AgglomerativeClustering
+from sklearn.cluster import KMeans, AgglomerativeClustering, MiniBatchKMeans
 from sklearn.mixture import GaussianMixture
 
-from yaft_preprocessor.utils.common import expend_vector_of_size
+from yaft_preprocessor.utils.common import vectors_to_matrix
 
 CLUSTERING_METHODS = {
     'kmeans': KMeans,
+    'minibatchkmeans': MiniBatchKMeans,
     'gmm': GaussianMixture,
     'hierarchical': AgglomerativeClustering
 }
 
+# Randomly initialised estimators are seeded, so that the same documents always get the same clusters.
+CLUSTERING_OPTIONS = {
+    'kmeans': {'random_state': 0},
+    'minibatchkmeans': {'random_state': 0},
+    'gmm': {'random_state': 0},
+}
+
+# These estimators do not accept sparse input, so only they pay for a dense copy.
+DENSE_CLUSTERING_METHODS = {'gmm', 'hierarchical'}
+
 
 def cluster(documents, classifier_slug, k):
     ids, vectors = zip(*[(d['id'], d['vector']) for d in documents])
-    n = max(max(map(int, vector.keys() or [-1])) + 1 for vector in vectors)
-    vectors = [expend_vector_of_size(vector, n) for vector in vectors]
-    return dict(zip(
-        ids, CLUSTERING_METHODS[classifier_slug](k).fit_predict(vectors)
-    ))
+    vectors = vectors_to_matrix(vectors)
+    if classifier_slug in DENSE_CLUSTERING_METHODS:
+        vectors = vectors.toarray()
+    estimator = CLUSTERING_METHODS[classifier_slug](k, **CLUSTERING_OPTIONS.get(classifier_slug, {}))
+    return dict(zip(ids, estimator.fit_predict(vectors).tolist()))
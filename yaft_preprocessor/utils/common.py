@@ -1,5 +1,50 @@
-def expend_vector_of_size(positional_vector, n):
-    result = []
-    for i in range(n):
-        result.append(int(positional_vector.get(str(i), 0)))
-    return result
+import numpy
+from scipy.sparse import csr_matrix
+
+
+def vectors_to_matrix(positional_vectors, n=None):
+    # Column j holds the weight of term `j`, so the mapping is stable across requests and models.
+    # Terms at or beyond a given `n` are unknown to the model and are dropped.
+    indptr = [0]
+    indices = []
+    data = []
+    for positional_vector in positional_vectors:
+        for index, weight in positional_vector.items():
+            index = int(index)
+            if n is None or index < n:
+                indices.append(index)
+                data.append(float(weight))
+        indptr.append(len(indices))
+    if n is None:
+        n = max(indices, default=-1) + 1
+    matrix = csr_matrix(
+        (
+            numpy.array(data, dtype=numpy.float64),
+            numpy.array(indices, dtype=numpy.int32),
+            numpy.array(indptr, dtype=numpy.int64),
+        ),
+        shape=(len(indptr) - 1, n)
+    )
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def map_array(path):
+    try:
+        return numpy.load(path, mmap_mode='r')
+    except ValueError:
+        # empty arrays cannot be mapped
+        return numpy.load(path)
+
+
+class Persistent:
+    # `persistent_attributes` name the attributes that make up a trained object. Their values are numpy
+    # arrays, sparse matrices or JSON values, which is what the model store knows how to write.
+    persistent_attributes = ()
+
+    def get_state(self):
+        return {name: getattr(self, name) for name in self.persistent_attributes}
+
+    def set_state(self, state):
+        for name in self.persistent_attributes:
+            setattr(self, name, state[name])
@@ -1,102 +1,612 @@
-import math
-import vbcode
-import bitstring
+from bisect import bisect_left
+from itertools import chain
+
+import numpy
+from django.conf import settings
+
+from yaft_preprocessor.utils.bit_packing import as_unsigned, bit_lengths, pack, padded, read, unpack, walk
+from yaft_preprocessor.utils.framing import decode_integers, decode_varint, encode_integers, encode_varint
+from yaft_preprocessor.utils.workers import get_pool, get_workers, read_shared, shared, split
 
 GAMMA = 'gamma'
 VARIABLE_BYTE = 'varbyte'
+DELTA = 'delta'
+RICE = 'rice'
+PFOR_DELTA = 'pfordelta'
+AUTO = 'auto'
+
+PLAIN = 'plain'
+BLOCKED = 'blocked'
 
 COMPRESSION_TYPES = (
     GAMMA,
     VARIABLE_BYTE,
+    DELTA,
+    RICE,
+    PFOR_DELTA,
+    AUTO,
+)
+
+LAYOUTS = (
+    PLAIN,
+    BLOCKED,
 )
 
 MAGIC = '01111110'
 
+# A gamma code is n ones, a zero and the n bits below the leading one of the integer. A compressed value is
+# the codes after zero padding and MAGIC, so that the padding, MAGIC and codes fill whole bytes.
+
+
+def encode_gamma(integers):
+    try:
+        integers = numpy.asarray(integers, dtype=numpy.int64)
+    except OverflowError:
+        return encode_gamma_exactly(integers)
+    if len(integers) and integers.min() < 1:
+        raise ValueError('gamma codes only positive integers.')
+    lengths = bit_lengths(integers) - 1
+    # every code is written as two fields, the ones and the zero, then the bits below the leading one
+    leading = numpy.uint64(1) << lengths.astype(numpy.uint64)
+    ones = (leading - numpy.uint64(1)) << numpy.uint64(1)
+    rest = integers.astype(numpy.uint64) - leading
+    values = numpy.concatenate([as_unsigned([int(MAGIC, 2)]), numpy.stack([ones, rest], axis=1).ravel()])
+    widths = numpy.concatenate([[len(MAGIC)], numpy.stack([lengths + 1, lengths], axis=1).ravel()])
+    return pack(values, widths, offset=8 - int((2 * lengths + 1).sum()) % 8)
+
+
+def encode_gamma_exactly(integers):
+    # for integers beyond 64 bits
+    if min(integers) < 1:
+        raise ValueError('gamma codes only positive integers.')
+    bits = ''.join('1' * (integer.bit_length() - 1) + '0' + bin(integer)[3:] for integer in integers)
+    bits = '0' * (8 - len(bits) % 8) + MAGIC + bits
+    # the leading one keeps the padding when converting through an int
+    return int('1' + bits, 2).to_bytes(len(bits) // 8 + 1, 'big')[1:]
+
+
+def find_gamma_payload(bits):
+    start = int(numpy.argmax(bits[:16])) - 1 if len(bits) else -1
+    if start < 0 or ''.join(map(str, bits[start:start + len(MAGIC)])) != MAGIC:
+        raise ValueError('Compressed value does not start with the gamma magic.')
+    return start + len(MAGIC)
+
 
-def compress_using_gamma(integers: list):
-    bits = bitstring.BitArray()
-    for integer in integers:
-        bit_length = int(math.log(integer, 2))
-        for _ in range(bit_length):
-            bits.append('0b1')
-        bits.append('0b0')
-        integer_bits = []
-        while integer > 0:
-            integer_bits.append(integer % 2)
-            integer //= 2
-        for i in list(reversed(integer_bits))[1:]:
-            bits.append('0b1' if i == 1 else '0b0')
-    binary = bits.bin
-    binary = '0b' + ((8 - (len(binary) % 8)) * '0') + MAGIC + binary
-    return bitstring.BitArray(binary).hex
-
-
-def decompress_using_gamma(compressed_value: str):
-    bits = bitstring.BitArray(hex=compressed_value).bin
-    magic_index = bits.index(MAGIC)
-    bits = bits[magic_index + 8:]
+def decode_gamma(data):
+    bits = unpack(data)
+    starts, zeros = walk(bits, find_gamma_payload(bits), lambda start, offsets, zeros: 2 * (zeros - offsets) + 1)
+    lengths = zeros - starts
+    if len(lengths) and lengths.max() >= 64:
+        return decode_gamma_exactly(bits)
+    return read(padded(data), zeros + 1, lengths) + (numpy.uint64(1) << lengths.astype(numpy.uint64))
+
+
+def decode_gamma_exactly(bits):
+    bits = ''.join(map(str, bits.tolist()))
+    position = bits.index(MAGIC) + len(MAGIC)
     integers = []
-    while bits:
-        integer_length = bits.index('0')
-        bits = bits[integer_length + 1:]
-        integers.append(int('1' + bits[:integer_length], 2))
-        bits = bits[integer_length:]
+    while position < len(bits):
+        zero = bits.index('0', position)
+        length = zero - position
+        if zero + 1 + length > len(bits):
+            raise ValueError('Compressed value ends within a gamma code.')
+        integers.append(int('1' + bits[zero + 1:zero + 1 + length], 2))
+        position = zero + 1 + length
+    return integers
+
+
+def as_integers(integers):
+    try:
+        return numpy.asarray(integers, dtype=numpy.int64)
+    except OverflowError:
+        raise ValueError('integers must be below 2 ** 63.')
+
+
+def as_positive_integers(integers):
+    integers = as_integers(integers)
+    if len(integers) and integers.min() < 1:
+        raise ValueError('integers must be positive.')
     return integers
 
 
-def compress_using_variable_byte(integers: list):
-    return vbcode.encode(integers).hex()
+def read_varint(data, position):
+    varint = decode_varint(data, position)
+    if varint is None:
+        raise ValueError('Compressed value ends within a header.')
+    return varint
+
+
+def read_header(data, size):
+    # the header of a bit stream codec starts with its number of padding bits
+    if len(data) < size:
+        raise ValueError('Compressed value ends within a header.')
+    if data[0] > (7 if len(data) > size else 0):
+        raise ValueError('Compressed value has a bad padding length.')
+    return data[:size], padded(data[size:]), unpack(data[size:])
+
+
+# A variable byte code is the integer in groups of 7 bits, most significant first, one group per byte, with the
+# high bit set on the last byte; the format of the vbcode package.
+def encode_variable_byte(integers):
+    integers = as_integers(integers)
+    if len(integers) and integers.min() < 0:
+        raise ValueError('integers must not be negative.')
+    sizes = numpy.maximum(-(-bit_lengths(integers) // 7), 1)
+    of = numpy.repeat(numpy.arange(len(integers)), sizes)
+    # the number of groups below each byte's group
+    below = numpy.repeat(numpy.cumsum(sizes), sizes) - numpy.arange(len(of)) - 1
+    groups = (integers[of] >> 7 * below) & 127
+    return (groups | numpy.where(below == 0, 128, 0)).astype(numpy.uint8).tobytes()
+
+
+def decode_variable_byte(data):
+    data = numpy.frombuffer(data, dtype=numpy.uint8)
+    if len(data) and data[-1] < 128:
+        raise ValueError('Compressed value ends within a code.')
+    ends = numpy.flatnonzero(data >= 128)
+    if not len(ends):
+        return numpy.empty(0, dtype=numpy.uint64)
+    starts = numpy.concatenate([[0], ends[:-1] + 1])
+    sizes = ends + 1 - starts
+    if sizes.max() > 9:
+        raise ValueError('Compressed value has a code of more than 63 bits.')
+    below = numpy.repeat(ends, sizes) - numpy.arange(len(data))
+    groups = (data & 127).astype(numpy.uint64) << (7 * below).astype(numpy.uint64)
+    return numpy.bitwise_or.reduceat(groups, starts)
+
+
+# An Elias delta code is the gamma code of the bit length of the integer, then the bits below its leading one.
+# A compressed value is a byte holding the number of padding bits, then the padding and the codes.
+def encode_delta(integers):
+    integers = as_positive_integers(integers)
+    lengths = bit_lengths(integers)
+    length_lengths = bit_lengths(lengths) - 1
+    leading = numpy.uint64(1) << length_lengths.astype(numpy.uint64)
+    values = numpy.stack([
+        (leading - numpy.uint64(1)) << numpy.uint64(1),
+        lengths.astype(numpy.uint64) - leading,
+        integers.astype(numpy.uint64) - (numpy.uint64(1) << (lengths - 1).astype(numpy.uint64)),
+    ], axis=1).ravel()
+    widths = numpy.stack([length_lengths + 1, length_lengths, lengths - 1], axis=1).ravel()
+    padding = -int(widths.sum()) % 8
+    return bytes([padding]) + pack(values, widths, offset=padding)
+
+
+def decode_delta(data):
+    (padding,), stream, bits = read_header(data, 1)
+
+    def code_lengths(start, offsets, zeros):
+        # lengths of more than 64 bits cannot be valid, and leave their codes unfinished
+        length_lengths = numpy.minimum(zeros - offsets, 7)
+        lengths = read(stream, start + zeros + 1, length_lengths).astype(numpy.int64) + (1 << length_lengths)
+        return numpy.where(length_lengths < 7, 2 * length_lengths + lengths, len(bits) + 1)
+
+    starts, zeros = walk(bits, padding, code_lengths)
+    length_lengths = zeros - starts
+    lengths = read(stream, zeros + 1, length_lengths) + (numpy.uint64(1) << length_lengths.astype(numpy.uint64))
+    rest = read(stream, zeros + 1 + length_lengths, lengths - numpy.uint64(1))
+    return rest + (numpy.uint64(1) << (lengths - numpy.uint64(1)))
+
+
+# A Golomb-Rice code with parameter k writes n - 1 as its quotient by 2 ** k in unary, ones ended by a zero,
+# then its k low bits. k comes from the mean of the list, near the optimal Golomb parameter for geometrically
+# distributed gaps. A quotient of RICE_ESCAPE or more is written as RICE_ESCAPE ones and the 64 bits of n - 1,
+# so outliers cost a bounded number of bits. A compressed value is a byte holding the number of padding bits
+# and a byte holding k, then the padding and the codes.
+RICE_ESCAPE = 64
+
+
+def encode_rice(integers):
+    integers = as_positive_integers(integers)
+    k = int(bit_lengths([int(numpy.log(2) * integers.mean())])[0]) - 1 if len(integers) else 0
+    k = max(k, 0)
+    integers = integers.astype(numpy.uint64) - numpy.uint64(1)
+    quotients = integers >> numpy.uint64(k)
+    escaped = quotients >= RICE_ESCAPE
+    quotients[escaped] = RICE_ESCAPE - 1
+    ones = ((numpy.uint64(1) << quotients) - numpy.uint64(1)) << numpy.uint64(1)
+    values = numpy.stack([
+        numpy.where(escaped, ones | numpy.uint64(1), ones),
+        numpy.where(escaped, integers, integers & numpy.uint64(2 ** k - 1)),
+    ], axis=1).ravel()
+    widths = numpy.stack([
+        quotients.astype(numpy.int64) + 1, numpy.where(escaped, 64, k)
+    ], axis=1).ravel()
+    padding = -int(widths.sum()) % 8
+    return bytes([padding, k]) + pack(values, widths, offset=padding)
+
+
+def decode_rice(data):
+    (padding, k), stream, bits = read_header(data, 2)
+
+    def code_lengths(start, offsets, zeros):
+        quotients = zeros - offsets
+        return numpy.where(quotients < RICE_ESCAPE, quotients + 1 + k, RICE_ESCAPE + 64)
+
+    starts, zeros = walk(bits, padding, code_lengths)
+    quotients = (zeros - starts).astype(numpy.uint64)
+    escaped = quotients >= RICE_ESCAPE
+    integers = numpy.where(
+        escaped,
+        read(stream, starts + RICE_ESCAPE, numpy.full(len(starts), 64)),
+        (quotients << numpy.uint64(k)) | read(stream, zeros + 1, numpy.full(len(starts), k)),
+    )
+    return integers + numpy.uint64(1)
+
+
+# PForDelta splits a list into blocks of PFOR_BLOCK integers and codes each block relative to its minimum.
+# A block keeps the low b bits of every integer, with b chosen for the smallest block; the integers that do not
+# fit are exceptions, whose positions and remaining high bits follow. A compressed value is the varint count of
+# integers, then every block as the varint minimum, a byte each for b, the number of exceptions and the width of
+# their high bits, the low bits, the exception positions and the high bits, each part padded to whole bytes.
+# Every part is a run of equally wide fields, so blocks decode with a few vectorized reads.
+PFOR_BLOCK = 128
+
+
+def encode_pfor_delta(integers):
+    integers = as_positive_integers(integers)
+    count = len(integers)
+    if not count:
+        return encode_varint(0)
+    block_starts = numpy.arange(0, count, PFOR_BLOCK)
+    blocks = len(block_starts)
+    block_sizes = numpy.diff(block_starts, append=count)
+    block_of = numpy.repeat(numpy.arange(blocks), block_sizes)
+    index = numpy.arange(count) - block_of * PFOR_BLOCK
+    bases = numpy.minimum.reduceat(integers, block_starts)
+    offsets = integers - bases[block_of]
+    lengths = bit_lengths(offsets)
+
+    # the bits of every block for every b: b per integer, plus 8 bits of position and the high bits per exception
+    histogram = numpy.bincount(block_of * 65 + lengths, minlength=blocks * 65).reshape(blocks, 65)
+    exceptions = block_sizes[:, None] - numpy.cumsum(histogram, axis=1)
+    high_widths = numpy.maximum(numpy.maximum.reduceat(lengths, block_starts)[:, None] - numpy.arange(65), 0)
+    low_widths = numpy.argmin(block_sizes[:, None] * numpy.arange(65) + exceptions * (8 + high_widths), axis=1)
+    exceptions = exceptions[numpy.arange(blocks), low_widths]
+    high_widths = high_widths[numpy.arange(blocks), low_widths]
+
+    base_sizes = numpy.maximum(-(-bit_lengths(bases) // 7), 1)
+    base_of = numpy.repeat(numpy.arange(blocks), base_sizes)
+    base_index = numpy.arange(len(base_of)) - numpy.repeat(numpy.cumsum(base_sizes) - base_sizes, base_sizes)
+    base_bytes = (bases[base_of] >> 7 * base_index) & 127 | numpy.where(base_index < base_sizes[base_of] - 1, 128, 0)
+    offsets = offsets.astype(numpy.uint64)
+    low_of = low_widths[block_of].astype(numpy.uint64)
+    excepted = lengths > low_widths[block_of]
+    no_fields = numpy.zeros(blocks, dtype=numpy.int64)
+    # (block, part, index, value, width) of every field, written in block, part and index order
+    parts = [
+        (base_of, 0, base_index, base_bytes, 8),
+        (numpy.repeat(numpy.arange(blocks), 3), 1, numpy.tile(numpy.arange(3), blocks),
+         numpy.stack([low_widths, exceptions, high_widths], axis=1).ravel(), 8),
+        (block_of, 2, index, offsets & ((numpy.uint64(1) << low_of) - numpy.uint64(1)), low_of),
+        (numpy.arange(blocks), 3, no_fields, no_fields, -(block_sizes * low_widths) % 8),
+        (block_of[excepted], 4, index[excepted], index[excepted], 8),
+        (block_of[excepted], 5, index[excepted], offsets[excepted] >> low_of[excepted],
+         high_widths[block_of[excepted]]),
+        (numpy.arange(blocks), 6, no_fields, no_fields, -(exceptions * high_widths) % 8),
+    ]
+    fields = [
+        numpy.concatenate([numpy.broadcast_to(part[i], part[0].shape).astype(dtype) for part in parts])
+        for i, dtype in enumerate((numpy.int64, numpy.int64, numpy.int64, numpy.uint64, numpy.int64))
+    ]
+    order = numpy.lexsort((fields[2], fields[1], fields[0]))
+    return encode_varint(count) + pack(fields[3][order], fields[4][order])
 
 
-def decompress_using_variable_byte(compressed_value: str):
-    return vbcode.decode(bytes.fromhex(compressed_value))
+def decode_pfor_delta(data):
+    count, position = read_varint(data, 0)
+    # every block takes at least a byte of base and three of widths, so a count is checked before sizing arrays
+    if -(-count // PFOR_BLOCK) * 4 > len(data) - position:
+        raise ValueError('Compressed value is too short for its count.')
+    block_sizes = numpy.diff(numpy.arange(0, count, PFOR_BLOCK), append=count)
+    blocks = []
+    for size in block_sizes.tolist():
+        base, position = read_varint(data, position)
+        low_width, exceptions, high_width = data[position:position + 3]
+        position += 3
+        low_start = position
+        position += -(-size * low_width // 8)
+        blocks.append((base, low_width, exceptions, high_width, low_start, position, position + exceptions))
+        position += exceptions + -(-exceptions * high_width // 8)
+    if position != len(data):
+        raise ValueError('Compressed value does not match its headers.')
+    if not count:
+        return numpy.empty(0, dtype=numpy.uint64)
+    bases, low_widths, exceptions, high_widths, low_starts, exception_starts, high_starts = (
+        numpy.array(column, dtype=numpy.int64) for column in zip(*blocks)
+    )
+    stream = padded(data)
+    index = numpy.arange(count) - numpy.repeat(numpy.arange(len(blocks)) * PFOR_BLOCK, block_sizes)
+    integers = read(
+        stream, numpy.repeat(low_starts * 8, block_sizes) + index * numpy.repeat(low_widths, block_sizes),
+        numpy.repeat(low_widths, block_sizes)
+    )
+    exception_of = numpy.repeat(numpy.arange(len(blocks)), exceptions)
+    exception_index = numpy.arange(len(exception_of)) - numpy.repeat(numpy.cumsum(exceptions) - exceptions, exceptions)
+    positions = stream[exception_starts[exception_of] + exception_index].astype(numpy.int64)
+    if (positions >= block_sizes[exception_of]).any():
+        raise ValueError('Compressed value has an exception outside its block.')
+    high = read(
+        stream, high_starts[exception_of] * 8 + exception_index * high_widths[exception_of], high_widths[exception_of]
+    )
+    integers[exception_of * PFOR_BLOCK + positions] |= high << low_widths[exception_of].astype(numpy.uint64)
+    return integers + numpy.repeat(bases, block_sizes).astype(numpy.uint64)
 
 
 COMPRESSORS = {
-    GAMMA: compress_using_gamma,
-    VARIABLE_BYTE: compress_using_variable_byte,
+    GAMMA: encode_gamma,
+    VARIABLE_BYTE: encode_variable_byte,
+    DELTA: encode_delta,
+    RICE: encode_rice,
+    PFOR_DELTA: encode_pfor_delta,
 }
 
 DECOMPRESSORS = {
-    GAMMA: decompress_using_gamma,
-    VARIABLE_BYTE: decompress_using_variable_byte,
+    GAMMA: decode_gamma,
+    VARIABLE_BYTE: decode_variable_byte,
+    DELTA: decode_delta,
+    RICE: decode_rice,
+    PFOR_DELTA: decode_pfor_delta,
 }
 
+# `auto` compresses every list with each codec and keeps the smallest result, or with the `speed` criterion the
+# fastest to decode of those within `tolerance` of the smallest. The compressed value starts with a byte naming
+# its codec, so mixed values decode without being told their types. Codec ids are stored, never renumber them.
+CODEC_IDS = {
+    GAMMA: 0,
+    VARIABLE_BYTE: 1,
+    DELTA: 2,
+    RICE: 3,
+    PFOR_DELTA: 4,
+}
+CODECS_BY_ID = {codec_id: codec for codec, codec_id in CODEC_IDS.items()}
+SIZE = 'size'
+SPEED = 'speed'
+# from the fastest codec to decode to the slowest, as measured with benchmarks.compression
+DECODING_SPEED_ORDER = (VARIABLE_BYTE, PFOR_DELTA, GAMMA, RICE, DELTA)
+
+
+def encode_auto(integers, criterion=None, tolerance=None):
+    criterion = criterion or settings.COMPRESSION_AUTO['criterion']
+    if tolerance is None:
+        tolerance = settings.COMPRESSION_AUTO['tolerance']
+    encoded = {}
+    for codec in CODEC_IDS:
+        try:
+            encoded[codec] = COMPRESSORS[codec](integers)
+        except ValueError:
+            # integers out of the range of this codec
+            continue
+    if not encoded:
+        raise ValueError('No codec can compress these integers.')
+    smallest = min(len(value) for value in encoded.values())
+    if criterion == SPEED:
+        codec = next(
+            codec for codec in DECODING_SPEED_ORDER
+            if codec in encoded and len(encoded[codec]) <= smallest * (1 + tolerance)
+        )
+    else:
+        codec = next(codec for codec in encoded if len(encoded[codec]) == smallest)
+    return bytes([CODEC_IDS[codec]]) + encoded[codec]
+
+
+def decode_auto(data):
+    if not data or data[0] not in CODECS_BY_ID:
+        raise ValueError('Compressed value does not start with a codec id.')
+    return DECOMPRESSORS[CODECS_BY_ID[data[0]]](data[1:])
+
 
-def integers_to_gaps(integers: list):
-    if not integers:
+COMPRESSORS[AUTO] = encode_auto
+DECOMPRESSORS[AUTO] = decode_auto
+
+
+# Lists hold integers from 0, and codecs take integers from 1, so the gaps are those of the integers plus 1. The
+# offset is folded into the first gap, which saves a pass over the list each way.
+def integers_to_gaps(integers):
+    integers = as_integers(integers)
+    if not len(integers):
         raise ValueError('integers must be of positive length.')
-    return [
-        integers[0], *[
-            integers[i] - integers[i - 1] for i in range(1, len(integers))
-        ]
-    ]
+    gaps = numpy.diff(integers, prepend=-1)
+    if gaps.min() < 1:
+        raise ValueError('integers must be increasing and not negative.')
+    return gaps
 
 
-def gaps_to_integers(gaps: list):
-    if not gaps:
+def gaps_to_integers(gaps):
+    if not len(gaps):
         raise ValueError('gaps must be of positive length.')
-    result = [gaps[0]]
-    for i in range(1, len(gaps)):
-        result.append(gaps[i] + result[-1])
+    integers = numpy.cumsum(as_integers(gaps))
+    integers -= 1
+    return integers
+
+
+# The blocked layout compresses the gaps of a list in blocks of settings.COMPRESSION_BLOCK_SIZE integers, after a
+# skip table of the first integer and the compressed length of every block. A block can then be decoded on its
+# own, and a seek decodes only the block its target falls in. A compressed value is the varint count of integers
+# and of blocks, then for every block the varint difference of its first integer from that of the previous block
+# and its varint length, then the blocks.
+def compress_blocked(integers, compression_type, block_size=None):
+    block_size = block_size or settings.COMPRESSION_BLOCK_SIZE
+    gaps = integers_to_gaps(integers)
+    blocks = [COMPRESSORS[compression_type](gaps[i:i + block_size]) for i in range(0, len(gaps), block_size)]
+    firsts = numpy.diff(as_integers(integers)[::block_size], prepend=0).tolist()
+    table = [encode_varint(len(gaps)), encode_varint(len(blocks))]
+    for first, block in zip(firsts, blocks):
+        table.append(encode_varint(first))
+        table.append(encode_varint(len(block)))
+    return b''.join(table + blocks)
+
+
+class BlockedList:
+    # A compressed value of the blocked layout, read a block at a time. `next_geq` only moves forward, so a run
+    # of seeks with growing targets costs at most one decode per block.
+
+    def __init__(self, compressed_value: bytes, compression_type) -> None:
+        self.data = compressed_value
+        self.compression_type = compression_type
+        self.count, position = read_varint(compressed_value, 0)
+        blocks, position = read_varint(compressed_value, position)
+        self.firsts = []
+        self.offsets = [0]
+        for _ in range(blocks):
+            first, position = read_varint(compressed_value, position)
+            length, position = read_varint(compressed_value, position)
+            self.firsts.append(first + (self.firsts[-1] if self.firsts else 0))
+            self.offsets.append(self.offsets[-1] + length)
+        self.offsets = [position + offset for offset in self.offsets]
+        if self.offsets[-1] != len(compressed_value):
+            raise ValueError('Compressed value does not match its skip table.')
+        self.block = 0
+        self.decoded = None
+
+    def __len__(self):
+        return self.count
+
+    def decode_block(self, block):
+        if self.decoded and self.decoded[0] == block:
+            return self.decoded[1]
+        gaps = DECOMPRESSORS[self.compression_type](self.data[self.offsets[block]:self.offsets[block + 1]])
+        integers = gaps_to_integers(gaps)
+        integers += self.firsts[block] - integers[0]
+        self.decoded = block, integers
+        return integers
+
+    def __iter__(self):
+        for block in range(len(self.firsts)):
+            yield self.decode_block(block)
+
+    def next_geq(self, target):
+        # the smallest integer of at least `target` from the current position on, or None past the end
+        self.block = max(self.block, bisect_left(self.firsts, target + 1) - 1)
+        while self.block < len(self.firsts):
+            integers = self.decode_block(self.block)
+            i = numpy.searchsorted(integers, target)
+            if i < len(integers):
+                return int(integers[i])
+            self.block += 1
+        return None
+
+
+def decompress_blocked(compressed_value: bytes, compression_type):
+    return numpy.concatenate(list(BlockedList(compressed_value, compression_type)))
+
+
+def intersect(lists):
+    # the integers of all the given BlockedLists, seeking through the others for each integer of the shortest
+    lists = sorted(lists, key=len)
+    result = []
+    if not lists:
+        return result
+    target = lists[0].next_geq(0)
+    while target is not None:
+        candidate = target
+        for blocked_list in lists:
+            candidate = blocked_list.next_geq(candidate)
+            if candidate != target:
+                break
+        if candidate == target:
+            result.append(target)
+            target = lists[0].next_geq(target + 1)
+        elif candidate is None:
+            break
+        else:
+            target = lists[0].next_geq(candidate)
     return result
 
 
-def compress(integers: list, compression_type):
+def compress(integers, compression_type, layout=PLAIN):
+    if layout == BLOCKED:
+        return compress_blocked(integers, compression_type)
     return COMPRESSORS[compression_type](integers_to_gaps(integers))
 
 
-def decompress(compressed_value: str, compression_type):
+def decompress(compressed_value: bytes, compression_type, layout=PLAIN):
+    if layout == BLOCKED:
+        return decompress_blocked(compressed_value, compression_type)
     return gaps_to_integers(DECOMPRESSORS[compression_type](compressed_value))
 
 
-def decompress_values(compressed_values_dict, compression_type):
-    return {
-        key: [i - 1 for i in decompress(compressed_value, compression_type)] for key, compressed_value in compressed_values_dict.items()
-    }
+# Compressed values are bytes; JSON payloads carry them as hex, binary ones as they are.
+def decompress_values(compressed_values_dict, compression_type, layout=PLAIN):
+    compressed_values = [bytes.fromhex(compressed_value) for compressed_value in compressed_values_dict.values()]
+    if sum(map(len, compressed_values)) >= settings.BULK_COMPRESSION['min_bytes']:
+        integer_lists = decompress_in_parallel(compressed_values, compression_type, layout)
+    else:
+        integer_lists = decompress_shard(compressed_values, compression_type, layout)
+    return {key: integers.tolist() for key, integers in zip(compressed_values_dict, integer_lists)}
+
+
+def compress_lists(integers_dict, compression_type, layout=PLAIN):
+    sizes = [len(integer_list) for integer_list in integers_dict.values()]
+    try:
+        integers = numpy.fromiter(chain.from_iterable(integers_dict.values()), numpy.int64, sum(sizes))
+    except OverflowError:
+        raise ValueError('integers must be below 2 ** 63.')
+    if integers.nbytes >= settings.BULK_COMPRESSION['min_bytes']:
+        compressed_values = compress_in_parallel(integers, sizes, compression_type, layout)
+    else:
+        compressed_values = compress_shard(split_lists(integers, sizes), compression_type, layout)
+    return {key: compressed_value.hex() for key, compressed_value in zip(integers_dict, compressed_values)}
+
+
+def split_lists(integers, sizes):
+    return numpy.split(integers, numpy.cumsum(sizes)[:-1])
+
+
+# Above settings.BULK_COMPRESSION['min_bytes'] of input, lists are compressed in shards of consecutive lists across
+# the worker pool. The integers or compressed values are concatenated into one shared memory block, and a task
+# gets the offsets of its lists. Results come back in shard order, so the output is that of a serial run.
+def compress_shard(integer_lists, compression_type, layout):
+    return [compress(integers, compression_type, layout) for integers in integer_lists]
+
+
+def decompress_shard(compressed_values, compression_type, layout):
+    return [decompress(compressed_value, compression_type, layout) for compressed_value in compressed_values]
+
+
+def compress_shared_shard(name, ends, compression_type, layout):
+    integers = read_shared(name, numpy.int64, ends[0], ends[-1])
+    return compress_shard(split_lists(integers, numpy.diff(ends)), compression_type, layout)
+
+
+def decompress_shared_shard(name, ends, compression_type, layout):
+    data = read_shared(name, numpy.uint8, ends[0], ends[-1]).tobytes()
+    compressed_values = [data[start - ends[0]:end - ends[0]] for start, end in zip(ends[:-1], ends[1:])]
+    return decompress_shard(compressed_values, compression_type, layout)
+
+
+def run_shards(task, array, sizes, compression_type, layout):
+    ends = numpy.concatenate([[0], numpy.cumsum(sizes, dtype=numpy.int64)]).tolist()
+    boundaries = split(sizes, 4 * get_workers())
+    with shared(array) as name:
+        futures = [
+            get_pool().submit(task, name, ends[start:stop + 1], compression_type, layout)
+            for start, stop in zip(boundaries[:-1], boundaries[1:])
+        ]
+        return [result for future in futures for result in future.result()]
+
+
+def compress_in_parallel(integers, sizes, compression_type, layout=PLAIN):
+    return run_shards(compress_shared_shard, integers, sizes, compression_type, layout)
+
+
+def decompress_in_parallel(compressed_values, compression_type, layout=PLAIN):
+    data = numpy.frombuffer(b''.join(compressed_values), dtype=numpy.uint8)
+    return run_shards(decompress_shared_shard, data, list(map(len, compressed_values)), compression_type, layout)
+
+
+def intersect_values(compressed_values, compression_type):
+    # the integers common to compressed values of the blocked layout, without decoding blocks they skip
+    return intersect(
+        BlockedList(bytes.fromhex(compressed_value), compression_type) for compressed_value in compressed_values
+    )
+
+
+def compress_frames(frames, compression_type, layout=PLAIN):
+    for key, integers in frames:
+        yield key, compress(decode_integers(integers), compression_type, layout)
 
 
-def compress_lists(integers_dict, compression_type):
-    return {
-        key: compress([i + 1 for i in integer_list], compression_type) for key, integer_list in integers_dict.items()
-    }
+def decompress_frames(frames, compression_type, layout=PLAIN):
+    for key, compressed_value in frames:
+        yield key, encode_integers(decompress(compressed_value, compression_type, layout))
@@ -0,0 +1,227 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+import numpy
+from django.conf import settings
+from scipy.sparse import csr_matrix, vstack
+
+from yaft_preprocessor.utils.common import map_array, vectors_to_matrix
+
+# Collected training documents live in append-only segments, one directory of sparse .npy arrays per upload,
+# listed in a manifest. Only the manifest update is serialized, so an upload costs time and I/O in proportion to its own
+# batch. Segments are merged log-structured: `fan_in` neighbouring segments of one level become one segment
+# of the next level, so each document is rewritten a logarithmic number of times. Replaced segments are
+# deleted after `grace` seconds, which leaves readers holding an older manifest time to finish. Segments are
+# memory-mapped, so batches can be read out of a segment of any size.
+# Every upload is stamped with the dataset version it creates. A merged segment keeps the version and last row
+# of each upload it holds in APPENDS, so the documents collected after any version can be found again.
+MANIFEST = 'manifest.json'
+LOCK = 'lock'
+SEGMENT_ARRAYS = ('data', 'indices', 'indptr', 'y')
+APPENDS = 'appends.npy'
+
+
+class DatasetStore:
+
+    def __init__(self, location, fan_in=8, grace=3600) -> None:
+        self.location = location
+        self.fan_in = fan_in
+        self.grace = grace
+
+    @contextmanager
+    def locked(self):
+        os.makedirs(self.location, exist_ok=True)
+        with open(os.path.join(self.location, LOCK), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read_manifest(self):
+        try:
+            with open(os.path.join(self.location, MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'version': 0, 'base': 0, 'segments': [], 'retired': []}
+
+    def write_manifest(self, manifest):
+        path = os.path.join(self.location, MANIFEST)
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temporary_path, path)
+
+    def get_version(self):
+        return self.read_manifest()['version']
+
+    def write_segment(self, x, y, level, appends=None):
+        name = 'segment-{:020d}-{}'.format(time.time_ns(), os.getpid())
+        os.makedirs(os.path.join(self.location, name))
+        for array_name, array in zip(SEGMENT_ARRAYS, (x.data, x.indices, x.indptr, y)):
+            numpy.save(os.path.join(self.location, name, '{}.npy'.format(array_name)), array)
+        segment = {
+            'name': name,
+            'level': level,
+            'rows': x.shape[0],
+            'columns': x.shape[1],
+            'classes': numpy.unique(y).tolist(),
+        }
+        if appends is not None:
+            numpy.save(os.path.join(self.location, name, APPENDS), appends)
+            segment['version'] = int(appends[-1, 0])
+        return segment
+
+    def get_appends(self, segment):
+        # (version, end row) of every upload in the segment; a level 0 segment is a single upload
+        if segment['level'] == 0:
+            return numpy.array([[segment['version'], segment['rows']]], dtype=numpy.int64)
+        return map_array(os.path.join(self.location, segment['name'], APPENDS))
+
+    def map_segment(self, segment):
+        return [
+            map_array(os.path.join(self.location, segment['name'], '{}.npy'.format(array_name)))
+            for array_name in SEGMENT_ARRAYS
+        ]
+
+    def read_segment(self, segment, columns=None, start=0, stop=None):
+        data, indices, indptr, y = self.map_segment(segment)
+        stop = segment['rows'] if stop is None else min(stop, segment['rows'])
+        # only the requested rows are copied out of the mapping
+        first, last = indptr[start], indptr[stop]
+        x = csr_matrix(
+            (numpy.array(data[first:last]), numpy.array(indices[first:last]), indptr[start:stop + 1] - first),
+            shape=(stop - start, columns or segment['columns'])
+        )
+        return x, numpy.array(y[start:stop])
+
+    def append(self, documents, reset=False):
+        x = vectors_to_matrix(document['vector'] for document in documents)
+        y = numpy.array([int(document['class']) for document in documents], dtype=numpy.int64)
+        segment = self.write_segment(x, y, 0)
+        with self.locked():
+            manifest = self.read_manifest()
+            previous_version = manifest['version']
+            # versions only grow, so a model's version tells exactly which uploads it has seen
+            segment['version'] = manifest['version'] = max(time.time_ns(), previous_version + 1)
+            if reset:
+                self.retire(manifest, manifest['segments'])
+                manifest['segments'] = []
+                manifest['base'] = manifest['version']
+            manifest['segments'].append(segment)
+            self.write_manifest(manifest)
+        return previous_version, manifest['version'], segment
+
+    def retire(self, manifest, segments):
+        now = time.time()
+        manifest['retired'].extend({'name': segment['name'], 'at': now} for segment in segments)
+        for retired in [retired for retired in manifest['retired'] if now - retired['at'] > self.grace]:
+            shutil.rmtree(os.path.join(self.location, retired['name']), ignore_errors=True)
+            manifest['retired'].remove(retired)
+
+    def find_run(self, segments):
+        start = 0
+        for i in range(1, len(segments) + 1):
+            if i == len(segments) or segments[i]['level'] != segments[start]['level']:
+                if i - start >= self.fan_in:
+                    return segments[start:start + self.fan_in]
+                start = i
+        return None
+
+    def compact(self):
+        # merging happens outside the lock; the result is only published if its run is still in the manifest
+        run = self.find_run(self.read_manifest()['segments'])
+        if not run:
+            return False
+        columns = max(segment['columns'] for segment in run)
+        parts = [self.read_segment(segment, columns) for segment in run]
+        appends = []
+        offset = 0
+        for segment in run:
+            segment_appends = numpy.array(self.get_appends(segment))
+            segment_appends[:, 1] += offset
+            appends.append(segment_appends)
+            offset += segment['rows']
+        merged = self.write_segment(
+            vstack([x for x, _ in parts], format='csr'), numpy.concatenate([y for _, y in parts]), run[0]['level'] + 1,
+            numpy.concatenate(appends)
+        )
+        with self.locked():
+            manifest = self.read_manifest()
+            names = [segment['name'] for segment in manifest['segments']]
+            run_names = [segment['name'] for segment in run]
+            if run_names[0] not in names or names[names.index(run_names[0]):][:len(run)] != run_names:
+                shutil.rmtree(os.path.join(self.location, merged['name']))
+                return False
+            start = names.index(run_names[0])
+            manifest['segments'][start:start + len(run)] = [merged]
+            self.retire(manifest, run)
+            self.write_manifest(manifest)
+        return True
+
+    @staticmethod
+    def get_columns(manifest):
+        return max((segment['columns'] for segment in manifest['segments']), default=0)
+
+    @staticmethod
+    def get_rows(manifest):
+        return sum(segment['rows'] for segment in manifest['segments'])
+
+    @staticmethod
+    def get_classes(manifest):
+        return sorted(set(label for segment in manifest['segments'] for label in segment['classes']))
+
+    def iter_segments(self, manifest=None):
+        manifest = manifest or self.read_manifest()
+        columns = self.get_columns(manifest)
+        for segment in manifest['segments']:
+            yield self.read_segment(segment, columns)
+
+    def iter_batches(self, batch_size, manifest=None, random=None):
+        # with a RandomState, batches come in random order, each shuffled within itself
+        manifest = manifest or self.read_manifest()
+        columns = self.get_columns(manifest)
+        batches = [
+            (segment, start) for segment in manifest['segments'] for start in range(0, segment['rows'], batch_size)
+        ]
+        if random is not None:
+            random.shuffle(batches)
+        for segment, start in batches:
+            x, y = self.read_segment(segment, columns, start, start + batch_size)
+            if random is not None:
+                order = random.permutation(len(y))
+                x, y = x[order], y[order]
+            yield x, y
+
+    def read_since(self, version, manifest=None):
+        # The documents collected after `version`, or None when a reset dropped documents a model of that
+        # version was trained on.
+        manifest = manifest or self.read_manifest()
+        if version < manifest.get('base', 0):
+            return None
+        columns = self.get_columns(manifest)
+        parts = []
+        for segment in manifest['segments']:
+            if segment['version'] <= version:
+                continue
+            appends = self.get_appends(segment)
+            first = numpy.searchsorted(appends[:, 0], version, side='right')
+            start = int(appends[first - 1, 1]) if first else 0
+            parts.append(self.read_segment(segment, columns, start))
+        if not parts:
+            return csr_matrix((0, columns)), numpy.empty(0, dtype=numpy.int64)
+        return vstack([x for x, _ in parts], format='csr'), numpy.concatenate([y for _, y in parts])
+
+    def read(self, manifest=None):
+        parts = list(self.iter_segments(manifest))
+        if not parts:
+            return csr_matrix((0, 0)), numpy.empty(0, dtype=numpy.int64)
+        return vstack([x for x, _ in parts], format='csr'), numpy.concatenate([y for _, y in parts])
+
+
+def get_dataset_store():
+    return DatasetStore(**settings.DATASET_STORE)
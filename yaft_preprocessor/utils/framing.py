@@ -0,0 +1,105 @@
+import numpy
+
+# The binary transport of the compression endpoints is a stream of frames, each a key and a payload:
+# the varint length of the UTF-8 key, the key, the varint length of the payload and the payload. Payloads are
+# compressed values, or lists of integers as little-endian unsigned 64 bit words. Frames are read and written
+# one at a time, so neither side holds a whole stream.
+# Keys are not empty: a frame with an empty key is a control frame. One with an empty payload ends every stream,
+# so a stream cut short is told apart from a complete one, and one with a UTF-8 message as payload ends a stream
+# whose writer failed.
+CONTENT_TYPE = 'application/octet-stream'
+INTEGER = numpy.dtype('<u8')
+READ_SIZE = 2 ** 16
+
+
+def encode_integers(integers):
+    return numpy.asarray(integers, dtype=INTEGER).tobytes()
+
+
+def decode_integers(payload):
+    if len(payload) % INTEGER.itemsize:
+        raise ValueError('Integer payloads must be a whole number of 64 bit words.')
+    return numpy.frombuffer(payload, dtype=INTEGER)
+
+
+def encode_varint(integer):
+    encoded = bytearray()
+    while integer > 127:
+        encoded.append(integer & 127 | 128)
+        integer >>= 7
+    encoded.append(integer)
+    return bytes(encoded)
+
+
+def decode_varint(data, position):
+    # returns None when `data` ends within the varint
+    integer = 0
+    shift = 0
+    while position < len(data):
+        byte = data[position]
+        integer |= (byte & 127) << shift
+        position += 1
+        shift += 7
+        if byte < 128:
+            return integer, position
+    return None
+
+
+def encode_frame(key, payload):
+    key = str(key).encode()
+    if not key:
+        raise ValueError('Frame keys must not be empty.')
+    return b''.join((encode_varint(len(key)), key, encode_varint(len(payload)), payload))
+
+
+def encode_control_frame(payload=b''):
+    return b''.join((encode_varint(0), encode_varint(len(payload)), payload))
+
+
+def write_frames(frames):
+    # a ValueError while the frames are produced is written as an error frame, as the response has already begun
+    try:
+        for key, payload in frames:
+            yield encode_frame(key, payload)
+    except ValueError as error:
+        yield encode_control_frame(str(error).encode())
+        return
+    yield encode_control_frame()
+
+
+def read_frames(stream):
+    buffer = bytearray()
+    position = 0
+    while True:
+        frame = decode_frame(buffer, position)
+        if frame:
+            key, payload, position = frame
+            if key is None:
+                if payload:
+                    raise ValueError(payload.decode())
+                return
+            yield key, payload
+            continue
+        chunk = stream.read(READ_SIZE) if stream else b''
+        if not chunk:
+            if position < len(buffer):
+                raise ValueError('Stream ends within a frame.')
+            raise ValueError('Stream ends without an end frame.')
+        # consumed frames are dropped before the buffer grows
+        del buffer[:position]
+        position = 0
+        buffer += chunk
+
+
+def decode_frame(buffer, position):
+    key_length = decode_varint(buffer, position)
+    if key_length is None or key_length[1] + key_length[0] > len(buffer):
+        return None
+    key_end = key_length[1] + key_length[0]
+    payload_length = decode_varint(buffer, key_end)
+    if payload_length is None or payload_length[1] + payload_length[0] > len(buffer):
+        return None
+    payload_end = payload_length[1] + payload_length[0]
+    # control frames have no key
+    key = bytes(buffer[key_length[1]:key_end]).decode() if key_length[0] else None
+    return key, bytes(buffer[payload_length[1]:payload_end]), payload_end
@@ -1,75 +1,47 @@
-from collections import defaultdict
+from collections import Counter
 
 import numpy
+from django.conf import settings
 
 from yaft_preprocessor.utils.classification import Classifier
+from yaft_preprocessor.utils.nearest_neighbours import INDEXES
 
 
 class KNNClassifier(Classifier):
+    persistent_attributes = Classifier.persistent_attributes + ('y',)
+    incremental = True
 
-    def __init__(self, method: str, param: float) -> None:
+    def __init__(self, method: str, param: float, index='lsh', **index_options) -> None:
         super().__init__(method, param)
-        self.intermediate = None
-        self.t = 2478
-        self.x = []
-        self.x_shards = {}
-        self.y_shards = {}
-        self.y = []
-        self.minimum = None
-        self.maximum = None
-        self.plains = None
-
-    def classify_document(self, document) -> int:
-        document_vector = numpy.array(self.expand_vector(document))
-        key = self.get_key(document_vector)
-        distance_values = [
-            (sum((v - document_vector) ** 2), self.y_shards[key][i])
-            for i, v in enumerate(self.x_shards[key])
-        ]
-        k = int(self.param)
-        nearest_neighbours = sorted(distance_values[:k], key=lambda x: x[0])
-        for distance, value in distance_values[k:]:
-            if distance < nearest_neighbours[-1][0]:
-                nearest_neighbours.append((distance, value))
-                del nearest_neighbours[-1]
-                nearest_neighbours.sort(key=lambda x: x[0])
-        labels = defaultdict(int)
-        for near_neighbour in nearest_neighbours:
-            labels[near_neighbour[1]] += 1
-        return sorted(labels.items(), key=lambda x: x[1], reverse=True)[0][0]
+        options = dict(settings.KNN_INDEXES[index], metric=settings.KNN_METRIC)
+        options.update(index_options)
+        self.index = INDEXES[index](**options)
+        self.y = None
+
+    def classify_matrix(self, x):
+        _, neighbours = self.index.search(x, int(self.param))
+        return numpy.array([self.vote(rows) for rows in neighbours], dtype=self.y.dtype)
+
+    def vote(self, rows):
+        # neighbours come nearest first, so ties go to the label of the nearest one
+        return Counter(self.y[rows].tolist()).most_common(1)[0][0]
+
+    def get_state(self):
+        state = super().get_state()
+        state.update(('index.' + name, value) for name, value in self.index.get_state().items())
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.index.set_state({
+            name[len('index.'):]: value for name, value in state.items() if name.startswith('index.')
+        })
 
     def train_using_training_set(self, x, y):
-        self.x = [numpy.array(v) for v in x]
-        self.y = y
-        # minimum = self.x[0]
-        # maximum = self.x[0]
-        # for v in self.x:
-        #     maximum = numpy.maximum(maximum, v)
-        #     minimum = numpy.minimum(minimum, v)
-        self.intermediate = sum(self.x) / len(self.x)
-        # self.intermediate = (maximum + minimum) / 2
-        self.plains = [
-            sum(self.intermediate[i:i + self.t])
-            for i in range(0, len(self.intermediate), self.t)
-        ]
-        for i, v in enumerate(self.x):
-            key = self.get_key(v)
-            if key in self.x_shards:
-                self.x_shards[key].append(v)
-                self.y_shards[key].append(self.y[i])
-            else:
-                self.x_shards[key] = [v]
-                self.y_shards[key] = [self.y[i]]
-        # self.minimum = minimum
-        # self.maximum = maximum
-
         self.y = y
+        self.index.build(x)
 
-    def get_key(self, v):
-        key = ''
-        for i in range(0, len(v), self.t):
-            if sum(v[i: i + self.t]) > self.plains[int(i / self.t)]:
-                key += '1'
-            else:
-                key += '0'
-        return key
+    def update(self, x, y):
+        self.y = numpy.concatenate([self.y, y])
+        self.index.insert(x)
+        return True
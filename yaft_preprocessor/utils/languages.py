@@ -1,22 +1,98 @@
 import re
-from string import ascii_letters
-from hazm import Normalizer, WordTokenizer, Stemmer
-from hazm.utils import stopwords_list
-from nltk.corpus import stopwords
-from nltk import download
-from nltk.tokenize import word_tokenize
-from nltk.stem import PorterStemmer
+import threading
+from functools import lru_cache
+from itertools import islice
+
+import numpy
+from django.conf import settings
 
 FA = 'fa'
 EN = 'en'
 LANGUAGES = (FA, EN)
 
-download('stopwords')
-download('punkt')
-LANGUAGE_STOPWORDS = {
-    FA: set(stopwords_list()),
-    EN: set(stopwords.words('english')),
-}
+
+# NLP resources are built on first use of their language, once per process, so importing this module loads neither
+# hazm nor NLTK and a process that never preprocesses never pays for them.
+class LazyResources:
+
+    def __init__(self, loaders) -> None:
+        self.loaders = loaders
+        self.loaded = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, language):
+        try:
+            return self.loaded[language]
+        except KeyError:
+            pass
+        with self.lock:
+            if language not in self.loaded:
+                self.loaded[language] = self.loaders[language]()
+            return self.loaded[language]
+
+    def __contains__(self, language):
+        return language in self.loaders
+
+
+def require_nltk_data(resource, package):
+    # NLTK data is looked up in settings.NLP_RESOURCES['data_path'] before NLTK's own paths, and downloaded there
+    # when missing, unless in offline mode
+    import nltk
+    data_path = settings.NLP_RESOURCES['data_path']
+    if data_path and data_path not in nltk.data.path:
+        nltk.data.path.insert(0, data_path)
+    try:
+        nltk.data.find(resource)
+    except LookupError:
+        if settings.NLP_RESOURCES['offline']:
+            raise LookupError('NLTK data {} is missing; fetch it with python -m nltk.downloader -d {} {}'.format(
+                resource, data_path or '<data path>', package
+            ))
+        if not nltk.download(package, download_dir=data_path, quiet=True):
+            raise LookupError('NLTK data {} could not be downloaded.'.format(resource))
+
+
+def load_english_stopwords():
+    require_nltk_data('corpora/stopwords', 'stopwords')
+    from nltk.corpus import stopwords
+    return set(stopwords.words('english'))
+
+
+def load_persian_stopwords():
+    from hazm.utils import stopwords_list
+    return set(stopwords_list())
+
+
+def load_english_stemmer():
+    from nltk.stem import PorterStemmer
+    return PorterStemmer().stem
+
+
+def load_persian_stemmer():
+    from hazm import Stemmer
+    return Stemmer().stem
+
+
+def load_persian_normalizer():
+    from hazm import Normalizer
+    return Normalizer().normalize
+
+
+def load_english_tokenizer():
+    require_nltk_data('tokenizers/punkt', 'punkt')
+    from nltk.tokenize import word_tokenize
+    return word_tokenize
+
+
+def load_persian_tokenizer():
+    from hazm import WordTokenizer
+    return WordTokenizer().tokenize
+
+
+LANGUAGE_STOPWORDS = LazyResources({
+    FA: load_persian_stopwords,
+    EN: load_english_stopwords,
+})
 
 
 class EnglishPunctuationSet:
@@ -30,20 +106,37 @@ LANGUAGE_PUNCTUATION = {
 }
 
 
-LANGUAGE_STEMMER = {
-    FA: Stemmer().stem,
-    EN: PorterStemmer().stem,
-}
+# Word frequencies are Zipfian, so most tokens are words stemmed before; stems are memoized in an LRU of
+# settings.STEM_CACHE['max_words'] words per language.
+def cached(load_stemmer):
+    def load():
+        return lru_cache(maxsize=settings.STEM_CACHE['max_words'])(load_stemmer())
+    return load
 
-LANGUAGE_NORMALIZER = {
-    EN: lambda x: x.lower(),
-    FA: Normalizer().normalize,
-}
 
-LANGUAGE_TOKENIZER = {
-    FA: WordTokenizer().tokenize,
-    EN: word_tokenize,
-}
+LANGUAGE_STEMMER = LazyResources({
+    FA: cached(load_persian_stemmer),
+    EN: cached(load_english_stemmer),
+})
+
+LANGUAGE_NORMALIZER = LazyResources({
+    EN: lambda: lambda x: x.lower(),
+    FA: load_persian_normalizer,
+})
+
+LANGUAGE_TOKENIZER = LazyResources({
+    FA: load_persian_tokenizer,
+    EN: load_english_tokenizer,
+})
+
+LANGUAGE_RESOURCES = (LANGUAGE_STOPWORDS, LANGUAGE_STEMMER, LANGUAGE_NORMALIZER, LANGUAGE_TOKENIZER)
+
+
+def load_resources(languages=LANGUAGES):
+    # loads everything up front, for a process that would rather pay at startup than on its first request
+    for language in languages:
+        for resources in LANGUAGE_RESOURCES:
+            resources[language]
 
 
 def remove_stop_words(tokens, language):
@@ -55,6 +148,8 @@ def remove_punctuation(tokens, language):
 
 
 def preprocess_document_of_language(document: str, lang, stem=True):
+    if stem and settings.PREPROCESSING_ENGINE == FUSED:
+        return LANGUAGE_ENGINE[lang](document)
     normalized_document = LANGUAGE_NORMALIZER[lang](document)
     tokens = LANGUAGE_TOKENIZER[lang](normalized_document)
     words = remove_punctuation(tokens, lang)
@@ -62,18 +157,158 @@ def preprocess_document_of_language(document: str, lang, stem=True):
     return stemmed_words
 
 
-LANGUAGE_CONTAINS_LETTER = {
-    EN: lambda letter: letter in ascii_letters,
-    FA: lambda letter: re.compile('^[آ-ی]$').match(letter),
+# The fused engines give the words of preprocess_document_of_language in fewer passes, dropping punctuation
+# and stemming while the tokens are produced. English documents made only of ASCII letters, whitespace and
+# punctuation that the Treebank tokenizer always splits off, with at most a final period, are split with a single
+# regex, as no sentence boundary or word-internal punctuation can change their words there; only the Treebank
+# contractions spelled with letters alone are split further. Other documents go through the NLTK tokenizer.
+# hazm's normalizer and tokenizer have no such simple case, so Persian only fuses the passes after them.
+REFERENCE = 'reference'
+FUSED = 'fused'
+
+# a comma or colon only splits off when it is not followed by another
+ENGLISH_SIMPLE_DOCUMENT = re.compile(r'(?:[A-Za-z\s;!?()\[\]{}"]|[,:](?![,:]))*(?:\.[)\]}"]*)?\s*')
+ENGLISH_WORD = re.compile(r'[a-z]+')
+ENGLISH_CONTRACTIONS = {
+    'cannot': ('can', 'not'),
+    'gimme': ('gim', 'me'),
+    'gonna': ('gon', 'na'),
+    'gotta': ('got', 'ta'),
+    'lemme': ('lem', 'me'),
+    'wanna': ('wan', 'na'),
+}
+
+
+def split_simple_english_document(document):
+    # the words of a lower case document, or None if it needs the NLTK tokenizer
+    if not ENGLISH_SIMPLE_DOCUMENT.fullmatch(document):
+        return None
+    words = []
+    for word in ENGLISH_WORD.findall(document):
+        words.extend(ENGLISH_CONTRACTIONS.get(word, (word,)))
+    return words
+
+
+def load_english_engine():
+    stemmer = LANGUAGE_STEMMER[EN]
+    tokenizer = LANGUAGE_TOKENIZER[EN]
+
+    def preprocess(document):
+        document = document.lower()
+        words = split_simple_english_document(document)
+        if words is None:
+            return dict(enumerate(stemmer(token) for token in tokenizer(document) if token.isalpha()))
+        return dict(enumerate(map(stemmer, words)))
+    return preprocess
+
+
+def load_persian_engine():
+    normalizer = LANGUAGE_NORMALIZER[FA]
+    tokenizer = LANGUAGE_TOKENIZER[FA]
+    stemmer = LANGUAGE_STEMMER[FA]
+    # tokens are dropped when they occur in the punctuation string, so every substring of it is punctuation
+    punctuation = LANGUAGE_PUNCTUATION[FA]
+    punctuation = {punctuation[i:j] for i in range(len(punctuation) + 1) for j in range(i, len(punctuation) + 1)}
+
+    def preprocess(document):
+        return dict(enumerate(stemmer(token) for token in tokenizer(normalizer(document)) if token not in punctuation))
+    return preprocess
+
+
+LANGUAGE_ENGINE = LazyResources({
+    EN: load_english_engine,
+    FA: load_persian_engine,
+})
+
+
+# Languages are told apart by script: the characters of a bounded prefix of each document are classified at once
+# through a table of code points, and the language with most letters wins, if it has enough of them.
+LANGUAGE_LETTERS = {
+    EN: ('AZ', 'az'),
+    FA: ('آی',),
 }
 
 
+def build_script_table():
+    # the position in LANGUAGES plus one of the language each code point below 2 ** 16 is a letter of, or 0
+    table = numpy.zeros(2 ** 16 + 1, dtype=numpy.intp)
+    for index, language in enumerate(LANGUAGES, 1):
+        for first, last in LANGUAGE_LETTERS[language]:
+            table[ord(first):ord(last) + 1] = index
+    return table
+
+
+SCRIPT_TABLE = build_script_table()
+
+
+def get_script_ratios(documents):
+    # the share of the characters of each document prefix that are letters of each language
+    prefixes = [document[:settings.LANGUAGE_DETECTION['prefix_length']] for document in documents]
+    lengths = numpy.array([len(prefix) for prefix in prefixes], dtype=numpy.intp)
+    code_points = numpy.frombuffer(''.join(prefixes).encode('utf-32-le', 'surrogatepass'), dtype=numpy.uint32)
+    scripts = SCRIPT_TABLE[numpy.minimum(code_points, len(SCRIPT_TABLE) - 1)]
+    owners = numpy.repeat(numpy.arange(len(prefixes)), lengths)
+    columns = len(LANGUAGES) + 1
+    counts = numpy.bincount(owners * columns + scripts, minlength=len(prefixes) * columns).reshape(-1, columns)
+    ratios = counts[:, 1:] / numpy.maximum(lengths, 1)[:, None]
+    return [dict(zip(LANGUAGES, row)) for row in ratios.tolist()]
+
+
+def detect_language(ratios):
+    language, ratio = max(ratios.items(), key=lambda item: item[1])
+    letters = sum(ratios.values())
+    if not letters or ratio < settings.LANGUAGE_DETECTION['min_share'] * letters:
+        return settings.LANGUAGE_DETECTION['default']
+    return language
+
+
+def detect_languages(documents: dict):
+    return {
+        doc_id: {'language': detect_language(ratios), 'ratios': ratios}
+        for doc_id, ratios in zip(documents, get_script_ratios(documents.values()))
+    }
+
+
 def get_document_language(document):
-    for letter in document:
-        for language in LANGUAGE_CONTAINS_LETTER:
-            if LANGUAGE_CONTAINS_LETTER[language](letter):
-                return language
+    return detect_language(get_script_ratios([document])[0])
 
 
 def process_document_of_unknown_language(document, stem=True):
     return preprocess_document_of_language(document, get_document_language(document), stem=stem)
+
+
+def warm_stem_caches():
+    # Preprocesses the words of the STEM_CACHE['warm_words'] file, one per line and most frequent first, so that the
+    # stems of the tokens they give are cached before any document is. At most half the cache is filled, leaving the
+    # rest to the words met while serving.
+    path = settings.STEM_CACHE.get('warm_words')
+    if not path:
+        return
+    with open(path, encoding='utf-8') as f:
+        words = [line.strip() for line in islice(f, settings.STEM_CACHE['max_words'] // 2)]
+    words = [word for word in words if word]
+    # a language whose resources cannot be loaded is left cold, to fail on its first document as without warming
+    unavailable = set()
+    for word, ratios in zip(words, get_script_ratios(words)):
+        language = detect_language(ratios)
+        if not any(ratios.values()) or language in unavailable:
+            continue
+        try:
+            preprocess_document_of_language(word, language)
+        except LookupError:
+            unavailable.add(language)
+
+
+def get_stem_cache_stats():
+    # warming counts as misses
+    stats = {}
+    for language, stem in list(LANGUAGE_STEMMER.loaded.items()):
+        info = stem.cache_info()
+        stats[language] = {
+            'hits': info.hits,
+            'misses': info.misses,
+            'hit_rate': info.hits / (info.hits + info.misses) if info.hits + info.misses else 0.0,
+            'words': info.currsize,
+            'max_words': info.maxsize,
+        }
+    return stats
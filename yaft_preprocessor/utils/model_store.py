@@ -0,0 +1,195 @@
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+
+import numpy
+from django.conf import settings
+from scipy.sparse import csr_matrix, issparse
+
+from yaft_preprocessor.utils.classification import Classifier, get_dataset_version
+from yaft_preprocessor.utils.common import map_array
+
+# Every trained model is a directory of versions. A version holds a JSON header and one .npy file per array,
+# and the CURRENT file names the version readers should load. Arrays are memory-mapped on load, so processes
+# serving the same model share its pages instead of each holding a deserialized copy.
+HEADER = 'header.json'
+CURRENT = 'CURRENT'
+SPARSE_PARTS = ('data', 'indices', 'indptr')
+KEPT_VERSIONS = 2
+
+
+def get_model_directory(key):
+    return os.path.join(settings.MODEL_STORE_LOCATION, quote(key, safe=''))
+
+
+def write_atomically(path, content):
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary_path, 'w') as f:
+        f.write(content)
+    os.replace(temporary_path, path)
+
+
+def save_model(key, classifier):
+    directory = get_model_directory(key)
+    version = '{:020d}-{}'.format(time.time_ns(), os.getpid())
+    version_directory = os.path.join(directory, version)
+    os.makedirs(version_directory)
+    header = {'method': classifier.method, 'param': classifier.param, 'values': {}, 'arrays': [], 'matrices': {}}
+    for name, value in classifier.get_state().items():
+        if issparse(value):
+            value = value.tocsr()
+            header['matrices'][name] = value.shape
+            for part in SPARSE_PARTS:
+                numpy.save(os.path.join(version_directory, '{}.{}.npy'.format(name, part)), getattr(value, part))
+        elif isinstance(value, numpy.ndarray):
+            header['arrays'].append(name)
+            numpy.save(os.path.join(version_directory, '{}.npy'.format(name)), value)
+        else:
+            header['values'][name] = value
+    write_atomically(os.path.join(version_directory, HEADER), json.dumps(header))
+    write_atomically(os.path.join(directory, CURRENT), version)
+    # processes still mapping an older version keep reading it after its files are unlinked
+    versions = sorted(name for name in os.listdir(directory) if name != CURRENT and not name.endswith('.tmp'))
+    for old_version in versions[:-KEPT_VERSIONS]:
+        shutil.rmtree(os.path.join(directory, old_version), ignore_errors=True)
+    return version
+
+
+def get_current_version(key):
+    try:
+        with open(os.path.join(get_model_directory(key), CURRENT)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def load_model(key, version=None):
+    version = version or get_current_version(key)
+    if version is None:
+        return None
+    version_directory = os.path.join(get_model_directory(key), version)
+    try:
+        with open(os.path.join(version_directory, HEADER)) as f:
+            header = json.load(f)
+    except FileNotFoundError:
+        return None
+    state = dict(header['values'])
+    for name in header['arrays']:
+        state[name] = map_array(os.path.join(version_directory, '{}.npy'.format(name)))
+    for name, shape in header['matrices'].items():
+        state[name] = csr_matrix(tuple(
+            map_array(os.path.join(version_directory, '{}.{}.npy'.format(name, part))) for part in SPARSE_PARTS
+        ), shape=shape)
+    classifier = Classifier.factory(header['method'], header['param'])
+    classifier.set_state(state)
+    return classifier
+
+
+def get_model_keys():
+    try:
+        return [unquote(name) for name in os.listdir(settings.MODEL_STORE_LOCATION)]
+    except FileNotFoundError:
+        return []
+
+
+def delete_models():
+    # like older versions, models still mapped by a process stay readable by it
+    shutil.rmtree(settings.MODEL_STORE_LOCATION, ignore_errors=True)
+
+
+def update_model(key):
+    # Returns the stored model brought up to the current dataset, or None if it has to be retrained.
+    classifier = load_model(key)
+    if classifier is None or not classifier.train_incrementally():
+        return None
+    return classifier
+
+
+def get_state_size(classifier):
+    size = 0
+    for value in classifier.get_state().values():
+        if issparse(value):
+            size += sum(getattr(value, part).nbytes for part in SPARSE_PARTS)
+        elif isinstance(value, numpy.ndarray):
+            size += value.nbytes
+    return size
+
+
+class ModelRegistry:
+    # A per-process LRU of loaded models in front of the store, bounded by model count and array bytes.
+    # An entry is valid while its version is still CURRENT, and a model trained on an older dataset version
+    # is not served at all, so both retrains and new documents invalidate without any messaging.
+
+    def __init__(self, max_models, max_bytes) -> None:
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.loads = 0
+        self.load_time = 0.0
+
+    def get(self, key):
+        version = get_current_version(key)
+        with self.lock:
+            entry = self.models.get(key)
+            if entry and entry[0] == version:
+                self.models.move_to_end(key)
+                self.hits += 1
+                classifier = entry[1]
+            elif version:
+                self.misses += 1
+                classifier = self.load(key, version)
+            else:
+                self.misses += 1
+                self.discard(key)
+                classifier = None
+        if classifier and classifier.dataset_version != get_dataset_version():
+            self.stale += 1
+            return None
+        return classifier
+
+    def load(self, key, version):
+        started = time.perf_counter()
+        classifier = load_model(key, version)
+        self.load_time += time.perf_counter() - started
+        self.loads += 1
+        self.discard(key)
+        if classifier is None:
+            return None
+        size = get_state_size(classifier)
+        self.models[key] = (version, classifier, size)
+        self.size += size
+        while len(self.models) > 1 and (len(self.models) > self.max_models or self.size > self.max_bytes):
+            self.discard(next(iter(self.models)))
+            self.evictions += 1
+        return classifier
+
+    def discard(self, key):
+        entry = self.models.pop(key, None)
+        if entry:
+            self.size -= entry[2]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'loads': self.loads,
+                'load_time': self.load_time,
+                'models': len(self.models),
+                'bytes': self.size,
+            }
+
+
+models = ModelRegistry(**settings.MODEL_REGISTRY)
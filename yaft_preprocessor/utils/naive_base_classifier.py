@@ -1,39 +1,79 @@
-from collections import defaultdict
-
 import numpy
+from scipy.sparse import csr_matrix
 
 from yaft_preprocessor.utils.classification import Classifier
 
 
 class NaiveBayesClassifier(Classifier):
+    # `legacy` reproduces the original scoring: P(c|t) over the terms present in a document, with 0.5 for
+    # terms no training document contains. Otherwise this is multinomial naive Bayes smoothed by `param`.
+    # Both are estimated from per class counts, which new documents only add to.
+    persistent_attributes = Classifier.persistent_attributes + (
+        'legacy', 'classes', 'class_counts', 'term_counts', 'log_p_c', 'log_p_t_c'
+    )
+    incremental = True
 
-    def __init__(self, method: str, param: float) -> None:
+    def __init__(self, method: str, param: float, legacy=False) -> None:
         super().__init__(method, param)
-        self.p_c = {}
-        self.p_t_c = defaultdict(dict)
+        self.legacy = legacy
+        self.classes = None
+        self.class_counts = None
+        self.term_counts = None
+        self.log_p_c = None
+        self.log_p_t_c = None
+
+    def classify_matrix(self, x):
+        if self.legacy:
+            x = (x > 0).astype(numpy.float64)
+        # sparse @ dense only touches stored entries, so absent terms never meet a -inf log probability
+        scores = x @ self.log_p_t_c.T + self.log_p_c
+        # ties go to the largest class, as they did when scores were sorted in reverse
+        return self.classes[len(self.classes) - 1 - numpy.argmax(scores[:, ::-1], axis=1)]
 
-    def classify_document(self, document) -> int:
-        scores = []
-        for c in self.p_c:
-            scores.append((self.calculate_document_score_for_class(document, c), c))
-        return sorted(scores, reverse=True)[0][1]
+    def has_negative_weights(self, x):
+        # multinomial probabilities are estimated from term counts; a negative one can leave a class with none
+        return not self.legacy and x.shape[0] and x.min() < 0
 
     def train_using_training_set(self, x, y):
-        label_counts = defaultdict(int)
-        for label in y:
-            label_counts[label] += 1
-        for label in label_counts:
-            self.p_c[label] = label_counts[label] / sum(label_counts.values())
-        term_counts = defaultdict(lambda: defaultdict(float))
-        for i in range(self.n):
-            for j, v in enumerate(x):
-                term_counts[i][y[j]] += v[i]
-        for i in range(self.n):
-            summation = sum(term_counts[i].values())
-            for label in label_counts:
-                self.p_t_c[i][label] = term_counts[i][label] / summation if summation else 0.5
-
-    def calculate_document_score_for_class(self, document, c):
-        return numpy.log(self.p_c[c]) + sum(map(numpy.log, [
-            self.p_t_c.get(int(i), {}).get(c, 0.5) for i, w in document.items() if float(w) > 0
-        ]))
+        if self.has_negative_weights(x):
+            raise ValueError('Multinomial naive Bayes takes no negative term weights.')
+        self.classes = numpy.unique(y)
+        self.class_counts, self.term_counts = self.count(x, y)
+        self.estimate()
+
+    def update(self, x, y):
+        if self.has_negative_weights(x):
+            return False
+        # earlier counts move into rows and columns for any new classes and terms
+        classes = numpy.union1d(self.classes, y)
+        rows = numpy.searchsorted(classes, self.classes)
+        class_counts = numpy.zeros(len(classes), dtype=numpy.int64)
+        class_counts[rows] = self.class_counts
+        term_counts = numpy.zeros((len(classes), x.shape[1]))
+        term_counts[rows, :self.term_counts.shape[1]] = self.term_counts
+        self.classes, self.n = classes, x.shape[1]
+        new_class_counts, new_term_counts = self.count(x, y)
+        self.class_counts = class_counts + new_class_counts
+        self.term_counts = term_counts + new_term_counts
+        self.estimate()
+        return True
+
+    def count(self, x, y):
+        labels = numpy.searchsorted(self.classes, y)
+        memberships = csr_matrix(
+            (numpy.ones(len(labels)), (labels, numpy.arange(len(labels)))),
+            shape=(len(self.classes), len(labels))
+        )
+        return numpy.bincount(labels, minlength=len(self.classes)), (memberships @ x).toarray()
+
+    def estimate(self):
+        self.log_p_c = numpy.log(self.class_counts / self.class_counts.sum())
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            if self.legacy:
+                summation = self.term_counts.sum(axis=0)
+                p_t_c = numpy.where(summation != 0, self.term_counts / summation, 0.5)
+            else:
+                p_t_c = (self.term_counts + self.param) / (
+                    self.term_counts.sum(axis=1, keepdims=True) + self.param * self.n
+                )
+            self.log_p_t_c = numpy.log(p_t_c)
@@ -0,0 +1,183 @@
+import heapq
+
+import numpy
+from scipy.sparse import csr_matrix, vstack
+from sklearn.preprocessing import normalize
+
+from yaft_preprocessor.utils.common import Persistent
+
+EUCLIDEAN = 'euclidean'
+COSINE = 'cosine'
+METRICS = (EUCLIDEAN, COSINE)
+
+
+def row_norms(x):
+    return numpy.asarray(x.multiply(x).sum(axis=1)).ravel()
+
+
+def prepare(x, metric):
+    # On unit rows the squared euclidean distance is twice the cosine distance, so both metrics share the
+    # same distance code and only differ by this normalization and a final halving.
+    if metric not in METRICS:
+        raise ValueError('metric must be one of {}.'.format(', '.join(METRICS)))
+    x = x.tocsr()
+    return normalize(x) if metric == COSINE else x
+
+
+def finish(distances, metric):
+    return distances / 2 if metric == COSINE else distances
+
+
+def widen(x, columns):
+    return csr_matrix((x.data, x.indices, x.indptr), shape=(x.shape[0], columns))
+
+
+class ExactIndex(Persistent):
+    # Brute force over the whole training matrix, a block of queries at a time. Blocks are sized so that
+    # their dense distance matrix stays within `memory` bytes.
+    persistent_attributes = ('metric', 'memory', 'x', 'x_t', 'norms')
+
+    def __init__(self, metric=EUCLIDEAN, memory=64 * 2 ** 20) -> None:
+        self.metric = metric
+        self.memory = memory
+        self.x = None
+        self.x_t = None
+        self.norms = None
+
+    def build(self, x):
+        self.x = prepare(x, self.metric)
+        self.x_t = self.x.T.tocsr()
+        self.norms = row_norms(self.x)
+
+    def insert(self, x):
+        x = prepare(x, self.metric)
+        self.x = vstack([widen(self.x, x.shape[1]), x], format='csr')
+        self.x_t = self.x.T.tocsr()
+        self.norms = numpy.concatenate([self.norms, row_norms(x)])
+
+    def search(self, x, k):
+        x = prepare(x, self.metric)
+        k = min(k, self.x.shape[0])
+        norms = row_norms(x)
+        block_size = max(1, self.memory // (8 * self.x.shape[0]))
+        distances = []
+        neighbours = []
+        for start in range(0, x.shape[0], block_size):
+            block = slice(start, start + block_size)
+            block_distances = norms[block, None] + self.norms - 2 * (x[block] @ self.x_t).toarray()
+            nearest = numpy.argpartition(block_distances, k - 1, axis=1)[:, :k]
+            nearest_distances = numpy.take_along_axis(block_distances, nearest, axis=1)
+            order = numpy.lexsort((nearest, nearest_distances), axis=1)
+            distances.extend(finish(numpy.take_along_axis(nearest_distances, order, axis=1), self.metric))
+            neighbours.extend(numpy.take_along_axis(nearest, order, axis=1))
+        return distances, neighbours
+
+
+class LSHIndex(Persistent):
+    # Multi-table random-hyperplane LSH. Every table hashes a row to the signs of `bits` projections of the
+    # row centred on the training mean. A query looks at its own bucket in every table, then at the `probes`
+    # neighbouring buckets whose bits were the closest to flipping, and scans everything when that still
+    # yields fewer than k candidates.
+    persistent_attributes = (
+        'metric', 'tables', 'bits', 'probes', 'seed', 'x', 'norms', 'hyperplanes', 'offsets', 'keys', 'starts', 'ends',
+        'rows',
+    )
+
+    def __init__(self, metric=EUCLIDEAN, tables=8, bits=12, probes=8, seed=0) -> None:
+        self.metric = metric
+        self.tables = tables
+        self.bits = bits
+        self.probes = probes
+        self.seed = seed
+        self.x = None
+        self.norms = None
+        self.hyperplanes = None
+        self.offsets = None
+        self.keys = None
+        self.starts = None
+        self.ends = None
+        self.rows = None
+
+    def build(self, x):
+        self.x = prepare(x, self.metric)
+        self.norms = row_norms(self.x)
+        random = numpy.random.RandomState(self.seed)
+        self.hyperplanes = random.standard_normal((x.shape[1], self.tables * self.bits)).astype(numpy.float32)
+        self.offsets = numpy.asarray(self.x.mean(axis=0)).ravel() @ self.hyperplanes
+        self.fill(self.x, numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.int64))
+
+    def insert(self, x):
+        # Hyperplane rows for new terms are drawn from a seed of their own, and the centre stays where it was,
+        # so rows already in the buckets keep their codes and only the new rows are hashed.
+        x = prepare(x, self.metric)
+        columns = self.hyperplanes.shape[0]
+        if x.shape[1] > columns:
+            random = numpy.random.RandomState([self.seed, columns])
+            self.hyperplanes = numpy.concatenate([self.hyperplanes, random.standard_normal(
+                (x.shape[1] - columns, self.tables * self.bits)
+            ).astype(numpy.float32)])
+        self.x = vstack([widen(self.x, x.shape[1]), x], format='csr')
+        self.norms = numpy.concatenate([self.norms, row_norms(x)])
+        self.fill(x, numpy.repeat(self.keys, self.ends - self.starts), self.rows, self.x.shape[0] - x.shape[0])
+
+    def fill(self, x, keys, rows, first_row=0):
+        # adds the rows of `x`, numbered from `first_row`, to buckets already holding `rows` under `keys`
+        codes, _ = self.hash(x)
+        # a bucket key holds its table above the code bits, so the buckets of all tables are sorted flat arrays
+        keys = numpy.concatenate([keys, (codes + self.table_offsets()).T.ravel()])
+        rows = numpy.concatenate([rows, numpy.tile(numpy.arange(first_row, first_row + x.shape[0]), self.tables)])
+        order = numpy.argsort(keys, kind='stable')
+        self.keys, self.starts = numpy.unique(keys[order], return_index=True)
+        self.ends = numpy.append(self.starts[1:], len(order))
+        self.rows = rows[order]
+
+    def table_offsets(self):
+        return numpy.arange(self.tables) << self.bits
+
+    def hash(self, x):
+        projections = (x @ self.hyperplanes - self.offsets).reshape(x.shape[0], self.tables, self.bits)
+        codes = ((projections > 0) << numpy.arange(self.bits)).sum(axis=2)
+        return codes, numpy.abs(projections)
+
+    def probe(self, codes, margins):
+        flips = numpy.argsort(margins, axis=1)[:, :self.probes]
+        probes = numpy.concatenate([codes[:, None], codes[:, None] ^ (1 << flips)], axis=1)
+        probes = (probes + self.table_offsets()[:, None]).ravel()
+        positions = numpy.searchsorted(self.keys, probes).clip(max=len(self.keys) - 1)
+        positions = positions[self.keys[positions] == probes]
+        return [self.rows[start:end] for start, end in zip(self.starts[positions], self.ends[positions])]
+
+    def dot(self, rows, query):
+        # dot products of the given training rows with a dense query, gathered straight from the CSR arrays
+        starts = self.x.indptr[rows]
+        lengths = self.x.indptr[rows + 1] - starts
+        positions = numpy.repeat(starts - numpy.cumsum(lengths) + lengths, lengths) + numpy.arange(lengths.sum())
+        products = self.x.data[positions] * query[self.x.indices[positions]]
+        return numpy.bincount(numpy.repeat(numpy.arange(len(rows)), lengths), products, minlength=len(rows))
+
+    def search(self, x, k):
+        x = prepare(x, self.metric)
+        codes, margins = self.hash(x)
+        norms = row_norms(x)
+        query = numpy.zeros(x.shape[1])
+        distances = []
+        neighbours = []
+        for i in range(x.shape[0]):
+            candidates = self.probe(codes[i], margins[i])
+            candidates = numpy.unique(numpy.concatenate(candidates)) if candidates else numpy.empty(0, int)
+            if len(candidates) < k:
+                candidates = numpy.arange(self.x.shape[0])
+            terms = x.indices[x.indptr[i]:x.indptr[i + 1]]
+            query[terms] = x.data[x.indptr[i]:x.indptr[i + 1]]
+            candidate_distances = self.norms[candidates] + norms[i] - 2 * self.dot(candidates, query)
+            query[terms] = 0
+            nearest = heapq.nsmallest(k, zip(candidate_distances.tolist(), candidates.tolist()))
+            distances.append(finish(numpy.array([distance for distance, _ in nearest]), self.metric))
+            neighbours.append(numpy.array([row for _, row in nearest], dtype=int))
+        return distances, neighbours
+
+
+INDEXES = {
+    'lsh': LSHIndex,
+    'exact': ExactIndex,
+}
@@ -1,4 +1,16 @@
-from yaft_preprocessor.utils.languages import preprocess_document_of_language
+import json
+from itertools import chain, repeat
+
+from django.conf import settings
+
+from yaft_preprocessor.utils.languages import FUSED, LANGUAGES, LANGUAGE_ENGINE, LANGUAGE_NORMALIZER, \
+    LANGUAGE_STEMMER, LANGUAGE_TOKENIZER, load_resources, preprocess_document_of_language, remove_punctuation, \
+    warm_stem_caches
+from yaft_preprocessor.utils.workers import get_pool
+
+PREPROCESSING_POOL = 'preprocessing'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+READ_SIZE = 2 ** 16
 
 
 def preprocess_document(document: str, lang):
@@ -6,4 +18,102 @@ def preprocess_document(document: str, lang):
 
 
 def preprocess_documents(data: dict, lang):
+    if len(data) >= settings.BULK_PREPROCESSING['min_documents']:
+        return preprocess_in_parallel(data, lang)
     return {doc_id: preprocess_document(document, lang) for doc_id, document in data.items()}
+
+
+def preprocess_chunk(documents, lang):
+    return [preprocess_document(document, lang) for document in documents]
+
+
+def load_worker_resources():
+    # a language whose resources cannot be loaded fails on the first document of it instead of breaking the pool
+    for language in LANGUAGES:
+        try:
+            load_resources([language])
+        except LookupError:
+            pass
+    warm_stem_caches()
+
+
+# Large batches are preprocessed in chunks of consecutive documents across a pool whose workers load the NLP
+# resources when they start. Chunks come back in order, so the result is that of preprocessing in process.
+def preprocess_in_parallel(data: dict, lang):
+    documents = list(data.values())
+    chunk_size = settings.BULK_PREPROCESSING['chunk_size']
+    chunks = [documents[i:i + chunk_size] for i in range(0, len(documents), chunk_size)]
+    results = get_pool(PREPROCESSING_POOL, load_worker_resources).map(preprocess_chunk, chunks, repeat(lang))
+    return dict(zip(data, chain.from_iterable(results)))
+
+
+# The streaming endpoint takes newline delimited JSON objects of an id and a document, and answers each with a
+# line of its id and words as it is done. Documents pass one at a time through a pipeline of generators, one per
+# step of preprocess_document_of_language, so memory does not grow with the stream.
+def read_lines(stream):
+    buffer = b''
+    while True:
+        chunk = stream.read(READ_SIZE) if stream else b''
+        if not chunk:
+            if buffer.strip():
+                yield buffer
+            return
+        *lines, buffer = (buffer + chunk).split(b'\n')
+        yield from (line for line in lines if line.strip())
+
+
+def read_documents(stream):
+    for number, line in enumerate(read_lines(stream), 1):
+        document = json.loads(line)
+        if not isinstance(document, dict) or 'id' not in document or not isinstance(document.get('document'), str):
+            raise ValueError('Line {} is not an object of an id and a document.'.format(number))
+        yield document['id'], document['document']
+
+
+def normalize(documents, lang):
+    normalizer = LANGUAGE_NORMALIZER[lang]
+    for doc_id, document in documents:
+        yield doc_id, normalizer(document)
+
+
+def tokenize(documents, lang):
+    tokenizer = LANGUAGE_TOKENIZER[lang]
+    for doc_id, document in documents:
+        yield doc_id, tokenizer(document)
+
+
+def drop_punctuation(documents, lang):
+    for doc_id, tokens in documents:
+        yield doc_id, remove_punctuation(tokens, lang)
+
+
+def stem(documents, lang):
+    stemmer = LANGUAGE_STEMMER[lang]
+    for doc_id, words in documents:
+        yield doc_id, {position: stemmer(word) for position, word in enumerate(words)}
+
+
+PIPELINE = (normalize, tokenize, drop_punctuation, stem)
+
+
+def preprocess_fused(documents, lang):
+    engine = LANGUAGE_ENGINE[lang]
+    for doc_id, document in documents:
+        yield doc_id, engine(document)
+
+
+def preprocess_stream(documents, lang):
+    if settings.PREPROCESSING_ENGINE == FUSED:
+        return preprocess_fused(documents, lang)
+    for step in PIPELINE:
+        documents = step(documents, lang)
+    return documents
+
+
+def preprocess_ndjson(stream, lang):
+    # a malformed line ends the response with a line holding the error
+    try:
+        for doc_id, words in preprocess_stream(read_documents(stream), lang):
+            yield (json.dumps({'id': doc_id, 'words': words}, ensure_ascii=False) + '\n').encode()
+    except ValueError as error:
+        yield (json.dumps({'error': str(error)}) + '\n').encode()
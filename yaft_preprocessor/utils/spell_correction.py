@@ -1,31 +1,41 @@
-from collections import defaultdict
+import os
+import time
+import zlib
+from array import array
+from itertools import repeat
+
 import editdistance
+import numpy
+from django.conf import settings
 from django.core.cache import cache
 
 from yaft_preprocessor.utils.languages import process_document_of_unknown_language
 
 
 class BiwordIndex:
+    # Biwords are interned to ids, each with the ascending ids of the words that contain it in an array('I'), and
+    # every word keeps its number of distinct biwords. A lookup counts the biwords each word shares with the query
+    # with one bincount over their postings, so the Jaccard similarity of every candidate follows without sets.
 
     def __init__(self):
-        self.dictionary = defaultdict(list)
+        self.biword_ids = {}
+        self.postings = []
+        self.biword_counts = array('I')
         self.words = []
         self.word_set = set()
 
     def index_words(self, words: list):
-        words = [word for word in words if word not in self.word_set]
-        for word in words:
-            self.word_set.add(word)
-        self.update_index(*self.create_index(words))
-
-    @staticmethod
-    def create_index(words):
-        dictionary = defaultdict(list)
-        for i, word in enumerate(words):
-            biwords = BiwordIndex.get_biwords(word)
+        words = [word for word in dict.fromkeys(words) if word not in self.word_set]
+        self.word_set.update(words)
+        for word_id, word in enumerate(words, len(self.words)):
+            biwords = set(self.get_biwords(word))
             for biword in biwords:
-                dictionary[biword].append(i)
-        return dictionary, words
+                biword_id = self.biword_ids.setdefault(biword, len(self.biword_ids))
+                if biword_id == len(self.postings):
+                    self.postings.append(array('I'))
+                self.postings[biword_id].append(word_id)
+            self.biword_counts.append(len(biwords))
+        self.words.extend(words)
 
     @staticmethod
     def get_biwords(word):
@@ -33,56 +43,163 @@ class BiwordIndex:
         biwords = [extended_word[j - 1: j + 1] for j in range(1, len(extended_word))]
         return biwords
 
-    def update_index(self, dictionary, words):
-        offset = len(self.words)
-        self.words.extend(words)
-        for biword, word_ids in dictionary.items():
-            self.dictionary[biword].extend([offset + word_id for word_id in word_ids])
+    def similarities(self, word):
+        # the ids of the words sharing a biword with `word` and their Jaccard similarities to it
+        biwords = set(self.get_biwords(word))
+        postings = [
+            numpy.frombuffer(self.postings[self.biword_ids[biword]], dtype=numpy.uint32)
+            for biword in biwords if biword in self.biword_ids
+        ]
+        if not postings:
+            return numpy.empty(0, dtype=numpy.intp), numpy.empty(0)
+        overlaps = numpy.bincount(numpy.concatenate(postings))
+        word_ids = numpy.flatnonzero(overlaps)
+        overlaps = overlaps[word_ids]
+        biword_counts = numpy.frombuffer(self.biword_counts, dtype=numpy.uint32)[word_ids]
+        return word_ids, overlaps / (len(biwords) + biword_counts - overlaps)
 
     def jaccard_lookup(self, word):
-        biwords = self.get_biwords(word)
-        set_of_query_biwords = set(biwords)
-        results = defaultdict(int)
-        for biword in biwords:
-            for word_id in self.dictionary[biword]:
-                results[word_id] += 1
-        for word_id in list(results.keys()):
-            dictionary_word = self.words[word_id]
-            results[word_id] /= len(
-                set_of_query_biwords | set(self.get_biwords(dictionary_word))
-            )
-        return {self.words[word_id]: results[word_id] for word_id in results}
+        word_ids, similarities = self.similarities(word)
+        return dict(zip(map(self.words.__getitem__, word_ids.tolist()), similarities.tolist()))
+
+    def correct(self, word):
+        word_ids, similarities = self.similarities(word)
+        if not len(word_ids):
+            return word
+        # the ten most similar words, the first indexed among equals, are ranked by edit distance
+        most_similar = numpy.argsort(-similarities, kind='stable')[:10]
+        word_ids, similarities = word_ids[most_similar].tolist(), similarities[most_similar].tolist()
+        ten_most_similar_words = [
+            (
+                self.words[word_id],
+                (
+                    -editdistance.eval(word, self.words[word_id]),
+                    jaccard_similarity
+                )
+            ) for word_id, jaccard_similarity in zip(word_ids, similarities)
+        ]
+        return sorted(ten_most_similar_words, key=lambda x: x[1], reverse=True)[0][0]
+
+
+class DeletionIndex:
+    # Candidates are the words sharing a variant with the query, where the variants of a word are those of its
+    # first `prefix_length` letters with up to `max_distance` letters deleted; every word within `max_distance`
+    # edits of the query, up to the prefix, shares one. Variants are kept as sorted CRC32s, which unlike hash()
+    # agree across the processes reading the cached index; a collision only adds a candidate to reject. The
+    # closest candidate within `max_distance` wins, ties going to the one sharing most bigrams as in BiwordIndex,
+    # and a word without one is left as it is.
+
+    def __init__(self, max_distance=2, prefix_length=7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words = []
+        self.word_set = set()
+        self.hashes = numpy.empty(0, dtype=numpy.uint32)
+        self.word_ids = numpy.empty(0, dtype=numpy.uint32)
+
+    def get_variant_hashes(self, word):
+        variants = edge = {word[:self.prefix_length]}
+        for _ in range(self.max_distance):
+            edge = {variant[:i] + variant[i + 1:] for variant in edge for i in range(len(variant))}
+            variants = variants | edge
+        return [zlib.crc32(variant.encode()) for variant in variants]
+
+    def index_words(self, words: list):
+        words = [word for word in dict.fromkeys(words) if word not in self.word_set]
+        self.word_set.update(words)
+        hashes = []
+        word_ids = []
+        for word_id, word in enumerate(words, len(self.words)):
+            variants = self.get_variant_hashes(word)
+            hashes.extend(variants)
+            word_ids.extend(repeat(word_id, len(variants)))
+        self.words.extend(words)
+        hashes = numpy.concatenate([self.hashes, numpy.array(hashes, dtype=numpy.uint32)])
+        word_ids = numpy.concatenate([self.word_ids, numpy.array(word_ids, dtype=numpy.uint32)])
+        order = numpy.argsort(hashes, kind='stable')
+        self.hashes = hashes[order]
+        self.word_ids = word_ids[order]
+
+    def lookup(self, word):
+        hashes = numpy.array(self.get_variant_hashes(word), dtype=numpy.uint32)
+        starts = numpy.searchsorted(self.hashes, hashes).tolist()
+        ends = numpy.searchsorted(self.hashes, hashes, side='right').tolist()
+        word_ids = [self.word_ids[start:end] for start, end in zip(starts, ends) if start < end]
+        if not word_ids:
+            return []
+        return numpy.unique(numpy.concatenate(word_ids)).tolist()
+
+    def correct(self, word):
+        if word in self.word_set:
+            return word
+        biwords = set(BiwordIndex.get_biwords(word))
+        corrected, rank = word, (self.max_distance + 1, 0)
+        for word_id in self.lookup(word):
+            candidate = self.words[word_id]
+            distance = editdistance.eval(word, candidate)
+            if distance <= min(rank[0], self.max_distance):
+                candidate_biwords = set(BiwordIndex.get_biwords(candidate))
+                candidate_rank = (distance, -len(biwords & candidate_biwords) / len(biwords | candidate_biwords))
+                if candidate_rank < rank:
+                    corrected, rank = candidate, candidate_rank
+        return corrected
+
+
+SPELLING_INDEXES = {
+    'biword': BiwordIndex,
+    'deletion': DeletionIndex,
+}
+
+
+# The cache holds the index and a version of it. Every process keeps the index it last loaded and only reads the
+# version per query, unpickling the index again only once another process or request has changed it.
+spelling_indexes = {}
+
+
+def get_spelling_index_key():
+    return 'spelling_index:{}'.format(settings.SPELL_CORRECTION_ENGINE)
+
+
+def get_spelling_index_version_key():
+    return 'spelling_index_version:{}'.format(settings.SPELL_CORRECTION_ENGINE)
+
+
+def create_spelling_index():
+    engine = settings.SPELL_CORRECTION_ENGINE
+    return SPELLING_INDEXES[engine](**settings.SPELL_CORRECTION_ENGINES[engine])
+
+
+def get_spelling_index():
+    key = get_spelling_index_key()
+    version = cache.get(get_spelling_index_version_key())
+    entry = spelling_indexes.get(key)
+    if entry and entry[0] == version:
+        return entry[1]
+    spelling_index = (cache.get(key) if version else None) or create_spelling_index()
+    spelling_indexes[key] = (version, spelling_index)
+    return spelling_index
 
 
 def index_words(words: list, reset=False):
-    biword_index = BiwordIndex() if reset else cache.get('biword_index', BiwordIndex())
-    biword_index.index_words(words)
-    cache.set('biword_index', biword_index)
-
-
-def correct_spelling(word):
-    index = cache.get('biword_index')
-    words_similarity = index.jaccard_lookup(word)
-    ten_most_similar_words = sorted(words_similarity.items(), key=lambda x: x[1], reverse=True)[:10]
-    if not ten_most_similar_words:
-        return word
-    ten_most_similar_words = [
-        (
-            similar_word,
-            (
-                -editdistance.eval(word, similar_word),
-                jaccard_similarity
-            )
-        ) for similar_word, jaccard_similarity in ten_most_similar_words
-    ]
-    return sorted(ten_most_similar_words, key=lambda x: x[1], reverse=True)[0][0]
+    # words are added to a copy read from the cache, so that queries never meet an index half updated
+    key = get_spelling_index_key()
+    spelling_index = create_spelling_index() if reset else cache.get(key) or create_spelling_index()
+    spelling_index.index_words(words)
+    version = '{}-{}'.format(time.time_ns(), os.getpid())
+    cache.set_many({key: spelling_index, get_spelling_index_version_key(): version})
+    spelling_indexes[key] = (version, spelling_index)
+
+
+def correct_spelling(word, spelling_index=None):
+    return (spelling_index or get_spelling_index()).correct(word)
 
 
 def preprocess_query(query):
     words = get_preprocessed_words_in_order(query)
+    spelling_index = get_spelling_index()
     result = []
     for word in words:
-        word = correct_spelling(word)
+        word = correct_spelling(word, spelling_index)
         result.append(word)
     return result
 
@@ -0,0 +1,96 @@
+import numpy
+from django.conf import settings
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import MultinomialNB
+
+from yaft_preprocessor.utils.classification import Classifier
+from yaft_preprocessor.utils.dataset_store import get_dataset_store
+
+
+class StreamingClassifier(Classifier):
+    # Trains out of core: the dataset is read a batch of `batch_size` rows at a time and handed to an estimator
+    # with `partial_fit`, so memory is bounded by the batch and the model rather than by the dataset.
+    # `estimator_attributes` are the fitted attributes that make up a trained model.
+    estimator_attributes = ('classes_',)
+    epochs = 1
+
+    def __init__(self, method: str, param: float) -> None:
+        super().__init__(method, param)
+        self.batch_size = settings.STREAMING_TRAINING['batch_size']
+        self.classifier = None
+
+    def train(self):
+        dataset_store = get_dataset_store()
+        manifest = dataset_store.read_manifest()
+        self.dataset_version = manifest['version']
+        self.n = dataset_store.get_columns(manifest)
+        self.classifier = self.create_estimator(dataset_store.get_rows(manifest))
+        classes = numpy.array(dataset_store.get_classes(manifest), dtype=numpy.int64)
+        random = numpy.random.RandomState(0)
+        for _ in range(self.epochs):
+            for x, y in dataset_store.iter_batches(self.batch_size, manifest, random):
+                self.classifier.partial_fit(x, y, classes=classes)
+
+    def train_using_training_set(self, x, y):
+        self.n = x.shape[1]
+        self.classifier = self.create_estimator(x.shape[0])
+        classes = numpy.unique(y)
+        for _ in range(self.epochs):
+            for start in range(0, x.shape[0], self.batch_size):
+                batch = slice(start, start + self.batch_size)
+                self.classifier.partial_fit(x[batch], y[batch], classes=classes)
+
+    def create_estimator(self, rows):
+        raise NotImplemented
+
+    def get_state(self):
+        state = super().get_state()
+        state.update((name, getattr(self.classifier, name)) for name in self.estimator_attributes)
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.classifier = self.create_estimator(0)
+        for name in self.estimator_attributes:
+            setattr(self.classifier, name, state[name])
+        self.classifier.n_features_in_ = self.n
+
+    def classify_matrix(self, x):
+        return self.classifier.predict(x)
+
+
+class SGDSVMClassifier(StreamingClassifier):
+    # A linear SVM fitted by stochastic gradient descent on the hinge loss. `param` is the C of `svm`; SGD
+    # minimizes the mean loss, so its regularization becomes 1 / (C * rows).
+    estimator_attributes = ('classes_', 'coef_', 'intercept_')
+
+    def __init__(self, method: str, param: float) -> None:
+        super().__init__(method, param)
+        self.epochs = settings.STREAMING_TRAINING['epochs']
+
+    def create_estimator(self, rows):
+        return SGDClassifier(loss='hinge', alpha=1 / (self.param * max(rows, 1)), random_state=0)
+
+
+class StreamingNaiveBayesClassifier(StreamingClassifier):
+    # Multinomial naive Bayes smoothed by `param`; its counts are sums over the batches.
+    estimator_attributes = ('classes_', 'class_count_', 'feature_count_', 'class_log_prior_', 'feature_log_prob_')
+    incremental = True
+
+    def create_estimator(self, rows):
+        return MultinomialNB(alpha=self.param)
+
+    def update(self, x, y):
+        # the estimator cannot take a class it was not trained with
+        if not numpy.isin(y, self.classifier.classes_).all():
+            return False
+        # loaded counts are read-only mappings, and new terms get zero counts
+        self.classifier.class_count_ = numpy.array(self.classifier.class_count_)
+        self.classifier.feature_count_ = numpy.pad(
+            self.classifier.feature_count_, ((0, 0), (0, x.shape[1] - self.classifier.feature_count_.shape[1]))
+        )
+        self.classifier.n_features_in_ = x.shape[1]
+        for start in range(0, x.shape[0], self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            self.classifier.partial_fit(x[batch], y[batch])
+        return True
@@ -0,0 +1,77 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy
+from django.conf import settings
+
+# Pools of worker processes per serving process, started on first use, for CPU bound work on large payloads.
+# Workers are spawned rather than forked, as the serving process may have threads, and get the settings their
+# tasks read from the parent. A pool can run an initializer in every worker, to load what its tasks share.
+# Arrays are handed to tasks in shared memory instead of being pickled into each.
+WORKER_SETTINGS = ('COMPRESSION_AUTO', 'COMPRESSION_BLOCK_SIZE', 'NLP_RESOURCES', 'PREPROCESSING_ENGINE', 'STEM_CACHE')
+
+pools = {}
+
+
+def get_workers():
+    return settings.WORKER_POOL['workers'] or os.cpu_count()
+
+
+def start_worker(options, initializer):
+    if not settings.configured:
+        settings.configure(**options)
+    if initializer:
+        initializer()
+
+
+def get_pool(name='default', initializer=None):
+    if name not in pools:
+        options = {name: getattr(settings, name) for name in WORKER_SETTINGS}
+        pools[name] = ProcessPoolExecutor(
+            get_workers(), mp_context=get_context('spawn'), initializer=start_worker, initargs=(options, initializer)
+        )
+    return pools[name]
+
+
+def shutdown_pools():
+    while pools:
+        pools.popitem()[1].shutdown()
+
+
+def split(sizes, shards):
+    # boundaries of up to `shards` runs of consecutive items with about equal total size
+    ends = numpy.cumsum(sizes)
+    total = ends[-1] if len(ends) else 0
+    boundaries = numpy.searchsorted(ends, numpy.arange(1, shards) * total / shards, side='right')
+    return numpy.unique(numpy.concatenate([[0], boundaries, [len(sizes)]])).tolist()
+
+
+@contextmanager
+def shared(array):
+    # a copy of `array` in shared memory, named for tasks to read with `read_shared`
+    memory = SharedMemory(create=True, size=max(array.nbytes, 1))
+    try:
+        view = numpy.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)
+        view[:] = array
+        del view
+        yield memory.name
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def read_shared(name, dtype, start, stop):
+    # workers share the resource tracker of the parent, which unlinks the block
+    memory = SharedMemory(name)
+    try:
+        view = numpy.ndarray(
+            (stop - start,), dtype=dtype, buffer=memory.buf, offset=start * numpy.dtype(dtype).itemsize
+        )
+        array = numpy.array(view)
+        del view
+        return array
+    finally:
+        memory.close()
@@ -1,17 +1,28 @@
-import os
+import logging
 from django.core.cache import caches
+from django.http import StreamingHttpResponse
+from kombu.exceptions import OperationalError
 from rest_framework.status import HTTP_400_BAD_REQUEST
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from yaft_preprocessor.celery import train
+from yaft_preprocessor.celery import compact_dataset, train, update_models
 from yaft_preprocessor.utils.classification import collect_documents
 from yaft_preprocessor.utils.clustering import cluster
-from yaft_preprocessor.utils.compression import COMPRESSION_TYPES, compress_lists, decompress_values
-from yaft_preprocessor.utils.languages import LANGUAGES
-from yaft_preprocessor.utils.preprocess import preprocess_documents
+from yaft_preprocessor.utils.compression import COMPRESSION_TYPES, LAYOUTS, PLAIN, compress_frames, compress_lists, \
+    decompress_frames, decompress_values, intersect_values
+from yaft_preprocessor.utils.framing import CONTENT_TYPE, read_frames, write_frames
+from yaft_preprocessor.utils.languages import LANGUAGES, detect_languages, get_stem_cache_stats
+from yaft_preprocessor.utils.model_store import delete_models, get_model_keys, models
+from yaft_preprocessor.utils.preprocess import NDJSON_CONTENT_TYPE, preprocess_documents, preprocess_ndjson
 from yaft_preprocessor.utils.spell_correction import index_words, preprocess_query
 
+logger = logging.getLogger(__name__)
+
+
+def get_media_type(request):
+    return request.content_type.split(';')[0].strip()
+
 
 class PreprocessView(APIView):
 
@@ -19,20 +30,34 @@ class PreprocessView(APIView):
         lang = request.GET.get('lang')
         if not lang or lang not in LANGUAGES:
             return Response({'error': 'Bad lang query parameter value.'}, status=400)
+        if get_media_type(request) == NDJSON_CONTENT_TYPE:
+            return StreamingHttpResponse(preprocess_ndjson(request.stream, lang), content_type=NDJSON_CONTENT_TYPE)
         data = request.data
         documents_dict = data.get('documents')
         return Response(preprocess_documents(documents_dict, lang))
 
 
+def frames_response(frames):
+    return StreamingHttpResponse(write_frames(frames), content_type=CONTENT_TYPE)
+
+
 class CompressView(APIView):
 
     def post(self, request):
         compression_type = request.GET.get('type')
         if not compression_type or compression_type not in COMPRESSION_TYPES:
             return Response({'error': 'Bad type query parameter value.'}, status=400)
+        layout = request.GET.get('layout', PLAIN)
+        if layout not in LAYOUTS:
+            return Response({'error': 'Bad layout query parameter value.'}, status=400)
+        if get_media_type(request) == CONTENT_TYPE:
+            return frames_response(compress_frames(read_frames(request.stream), compression_type, layout))
         data = request.data
         integers_dict = data.get('integer_lists')
-        return Response(compress_lists(integers_dict, compression_type))
+        try:
+            return Response(compress_lists(integers_dict, compression_type, layout))
+        except ValueError as error:
+            return Response({'error': str(error)}, status=400)
 
 
 class DecompressView(APIView):
@@ -41,9 +66,31 @@ class DecompressView(APIView):
         compression_type = request.GET.get('type')
         if not compression_type or compression_type not in COMPRESSION_TYPES:
             return Response({'error': 'Bad type query parameter value.'}, status=400)
+        layout = request.GET.get('layout', PLAIN)
+        if layout not in LAYOUTS:
+            return Response({'error': 'Bad layout query parameter value.'}, status=400)
+        if get_media_type(request) == CONTENT_TYPE:
+            return frames_response(decompress_frames(read_frames(request.stream), compression_type, layout))
         data = request.data
         compressed_values = data.get('compressed_values')
-        return Response(decompress_values(compressed_values, compression_type))
+        try:
+            return Response(decompress_values(compressed_values, compression_type, layout))
+        except ValueError as error:
+            return Response({'error': str(error)}, status=400)
+
+
+class IntersectView(APIView):
+
+    def post(self, request):
+        compression_type = request.GET.get('type')
+        if not compression_type or compression_type not in COMPRESSION_TYPES:
+            return Response({'error': 'Bad type query parameter value.'}, status=400)
+        # compressed values of the blocked layout
+        compressed_values = request.data.get('compressed_values')
+        try:
+            return Response({'integers': intersect_values(compressed_values, compression_type)})
+        except ValueError as error:
+            return Response({'error': str(error)}, status=400)
 
 
 class IndexWordsView(APIView):
@@ -66,9 +113,19 @@ class CollectDataSetView(APIView):
         reset = False
         if request.GET.get('reset') == 'true':
             reset = True
+        # the dataset store retires the collected documents itself, leaving readers of them time to finish
         if reset:
-            os.system('rm -rf /var/tmp/yaft_classification')
+            delete_models()
+            caches['classification'].delete('classification_is_under_process')
         collect_documents(documents, reset)
+        # the documents are stored either way; segments left unmerged are merged after a later upload, and a model
+        # not updated now catches up on its next training
+        try:
+            compact_dataset.delay()
+            if not reset and get_model_keys():
+                update_models.delay()
+        except OperationalError:
+            logger.exception('Could not schedule compacting the dataset and updating the models.')
         return Response({'status': 'success'}, 200)
 
 
@@ -95,7 +152,7 @@ class ClassifyView(APIView):
                 status=HTTP_400_BAD_REQUEST
             )
         key = 'classifier:{}:{}'.format(method, param)
-        already_classifier = caches['classification'].get(key)
+        already_classifier = models.get(key)
         if already_classifier:
             return Response(already_classifier.classify_documents(documents['vectors']), 200)
         scheduled = prepare_model(key, method, param)
@@ -105,6 +162,15 @@ class ClassifyView(APIView):
             return Response({"status": "to_many_requests", "detail": "Resource not enough."}, 204)
 
 
+class DetectLanguagesView(APIView):
+
+    def post(self, request):
+        documents = request.data.get('documents')
+        if not isinstance(documents, dict) or not all(isinstance(document, str) for document in documents.values()):
+            return Response({'error': 'Give documents as an object of strings.'}, status=400)
+        return Response(detect_languages(documents), 200)
+
+
 class PreprocessQueryView(APIView):
 
     def post(self, request):
@@ -113,6 +179,12 @@ class PreprocessQueryView(APIView):
         return Response(preprocess_query(query), 200)
 
 
+class StatsView(APIView):
+
+    def get(self, request):
+        return Response({'models': models.get_stats(), 'stem_cache': get_stem_cache_stats()}, 200)
+
+
 class ClusterView(APIView):
 
     def post(self, request):
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yaft_preprocessor.settings')
 
 application = get_wsgi_application()
+
+from yaft_preprocessor.utils.languages import warm_stem_caches  # noqa: E402
+
+warm_stem_caches()